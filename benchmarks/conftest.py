@@ -0,0 +1,117 @@
+"""
+Minimal pytest-benchmark style fixture.
+
+    pytest benchmarks --bench-save=.benchmarks/base.json
+    pytest benchmarks --bench-compare=.benchmarks/base.json --bench-threshold=0.25
+
+Every test receives `bench`, calls it with the measured function and gets its return value back.
+With --bench-compare a test fails when its median time is worse than the saved one by more than the threshold.
+"""
+import dataclasses
+import json
+import os
+import statistics
+import time
+import typing
+
+import pytest
+
+RESULTS: typing.Dict[str, "BenchResult"] = {}
+
+
+@dataclasses.dataclass
+class BenchResult:
+    rounds: int
+    iterations: int
+    min: float
+    median: float
+    mean: float
+
+
+class Bench:
+    def __init__(self, name: str, baseline: typing.Optional[BenchResult], threshold: float,
+                 min_round_time: float, rounds: int):
+        self.name = name
+        self.baseline = baseline
+        self.threshold = threshold
+        self.min_round_time = min_round_time
+        self.rounds = rounds
+
+    def __call__(self, func: typing.Callable, *args, setup: typing.Optional[typing.Callable[[], tuple]] = None,
+                 **kwargs):
+        """
+        Seconds per call of func(*args, **kwargs). With setup every call gets fresh arguments from setup(),
+        which is not timed, e.g. a new game for a function changing it.
+        """
+        if setup is not None:
+            times = []
+            for _ in range(self.rounds * 5):
+                call_args = setup()
+                start = time.perf_counter()
+                result = func(*call_args)
+                times.append(time.perf_counter() - start)
+            return self._record(times, 1, result)
+        iterations = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                result = func(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.min_round_time or iterations >= 1_000_000:
+                break
+            iterations *= 10 if elapsed < self.min_round_time / 10 else 2
+        times = []
+        for _ in range(self.rounds):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                result = func(*args, **kwargs)
+            times.append((time.perf_counter() - start) / iterations)
+        return self._record(times, iterations, result)
+
+    def _record(self, times: typing.List[float], iterations: int, result):
+        bench_result = BenchResult(rounds=len(times), iterations=iterations, min=min(times),
+                                   median=statistics.median(times), mean=statistics.fmean(times))
+        RESULTS[self.name] = bench_result
+        if self.baseline is not None and bench_result.median > self.baseline.median * (1 + self.threshold):
+            pytest.fail(f"{self.name}: median {bench_result.median * 1e6:.1f}us is more than {self.threshold:.0%} "
+                        f"worse than the baseline {self.baseline.median * 1e6:.1f}us")
+        return result
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("bench")
+    group.addoption("--bench-save", help="write results to this json file")
+    group.addoption("--bench-compare", help="json file saved by an earlier run to compare with")
+    group.addoption("--bench-threshold", type=float, default=0.25,
+                    help="allowed slowdown of the median compared to the baseline, 0.25 = 25%%")
+    group.addoption("--bench-rounds", type=int, default=10)
+    group.addoption("--bench-min-time", type=float, default=0.01, help="minimal duration of one round in seconds")
+
+
+@pytest.fixture(scope="session")
+def bench_baseline(request) -> typing.Dict[str, BenchResult]:
+    path = request.config.getoption("--bench-compare")
+    if not path:
+        return {}
+    with open(path) as f:
+        return {name: BenchResult(**result) for name, result in json.load(f).items()}
+
+
+@pytest.fixture
+def bench(request, bench_baseline) -> Bench:
+    config = request.config
+    return Bench(request.node.nodeid, bench_baseline.get(request.node.nodeid), config.getoption("--bench-threshold"),
+                 config.getoption("--bench-min-time"), config.getoption("--bench-rounds"))
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    if not RESULTS:
+        return
+    terminalreporter.section("benchmarks (median per call)")
+    for name, result in sorted(RESULTS.items()):
+        terminalreporter.write_line(f"{result.median * 1e6:12.1f}us  {name}")
+    path = config.getoption("--bench-save")
+    if path:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({name: dataclasses.asdict(result) for name, result in RESULTS.items()}, f, indent=2)
@@ -0,0 +1,116 @@
+"""
+Replays synthetic players through the real dispatcher and handlers with a LocalBot instead of telegram.
+
+    python -m benchmarks.load_test --users 1000 --games 3
+"""
+import argparse
+import asyncio
+import dataclasses
+import itertools
+import json
+import random
+import resource
+import statistics
+import tempfile
+import time
+import typing
+
+import aiogram
+
+from bot import handlers, webhook, board_pool
+
+
+@dataclasses.dataclass
+class LoadReport:
+    users: int
+    games: int
+    updates: int
+    seconds: float
+    updates_per_second: float
+    p50_ms: float
+    p99_ms: float
+    max_ms: float
+    max_rss_growth_mb: float
+
+
+def _max_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def _play(dp: aiogram.Dispatcher, bot: webhook.LocalBot, user_id: int, games: int, rng: random.Random,
+                update_ids: typing.Iterator[int], latencies: typing.List[float]):
+    """
+    Player starts games with /play and taps random closed cells of the last keyboard it received until the game ends
+    """
+    async def send(update: typing.Dict):
+        start = time.perf_counter()
+        await dp.process_update(aiogram.types.Update(**update))
+        latencies.append(time.perf_counter() - start)
+
+    for _ in range(games):
+        await send(webhook.message_update(next(update_ids), user_id, "/play"))
+        while True:
+            closed = bot.closed_cells(user_id)
+            if not closed:
+                break
+            await send(webhook.callback_update(next(update_ids), user_id, rng.choice(closed)))
+
+
+async def run_load(users: int = 100, games: int = 1, concurrency: int = 100, seed: int = 0,
+                   pool_size: int = 0) -> LoadReport:
+    bot = webhook.LocalBot(record=False)
+    dp = aiogram.Dispatcher(bot)
+    aiogram.Bot.set_current(bot)
+    aiogram.Dispatcher.set_current(dp)
+    rng = random.Random(seed)
+    update_ids = itertools.count(1)
+    latencies: typing.List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def player(user_id: int):
+        async with semaphore:
+            await _play(dp, bot, user_id, games, random.Random(rng.random()), update_ids, latencies)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        handlers.load_context(data_dir)
+        handlers.setup_handlers(dp)
+        handlers.start_board_pool(board_pool.BoardPool(pool_size))
+        rss_before = _max_rss_mb()
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*(player(user_id) for user_id in range(1, users + 1)))
+        finally:
+            seconds = time.perf_counter() - start
+            await handlers.close_context()
+            await (await bot.get_session()).close()
+    latencies.sort()
+    return LoadReport(
+        users=users, games=users * games, updates=len(latencies), seconds=round(seconds, 3),
+        updates_per_second=round(len(latencies) / seconds, 1),
+        p50_ms=round(statistics.median(latencies) * 1000, 3),
+        p99_ms=round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 3),
+        max_ms=round(latencies[-1] * 1000, 3),
+        max_rss_growth_mb=round(_max_rss_mb() - rss_before, 1),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--games", type=int, default=1, help="games played by every user")
+    parser.add_argument("--concurrency", type=int, default=100, help="users playing at the same time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pool-size", type=int, default=0, help="ready games kept for every difficulty")
+    parser.add_argument("--json", type=str, help="also write the report to this file")
+    args = parser.parse_args()
+    report = asyncio.run(run_load(args.users, args.games, args.concurrency, args.seed, args.pool_size))
+    for field, value in dataclasses.asdict(report).items():
+        print(f"{field}: {value}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(dataclasses.asdict(report), f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import random
+import typing
+
+import pytest
+
+from bot import keyboard_generator, button_texts
+from bot.game import saper_game, solver
+
+# rows, cols, explosives
+LARGE_BOARDS = [(30, 30, 150), (100, 100, 3000), (100, 100, 9000)]
+MODES = [0, 1, 2, 3]
+
+
+def _safe_cells(g: saper_game.Game) -> typing.List[typing.Tuple[int, int]]:
+    return [divmod(i, g.config.cols) for i, value in enumerate(g.cells) if value != saper_game.MINE and not g.opened[i]]
+
+
+def _play_to_the_end(g: saper_game.Game) -> saper_game.Game:
+    for x, y in _safe_cells(g):
+        if g.reveal_coordinate(x, y).game_over:
+            break
+    return g
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_create_game(bench, mode: int):
+    bench(saper_game.create_game, mode)
+
+
+@pytest.mark.parametrize('board', LARGE_BOARDS)
+def test_large_game_init(bench, board: typing.Tuple[int, int, int]):
+    rows, cols, explosives = board
+    bench(saper_game.Game, rows, cols, explosives, 1)
+
+
+@pytest.mark.parametrize('board', [(8, 8, 6), (11, 8, 30)] + LARGE_BOARDS)
+def test_generate_random_explosives(bench, board: typing.Tuple[int, int, int]):
+    bench(saper_game.Game.generate_random_explosives, *board)
+
+
+@pytest.mark.parametrize('board', [(8, 8, 6), (11, 8, 30)] + LARGE_BOARDS)
+def test_generate_grid(bench, board: typing.Tuple[int, int, int]):
+    rows, cols, explosives = board
+    mines = sum(1 << (x * cols + y) for x, y in saper_game.Game.generate_random_explosives(rows, cols, explosives))
+    bench(saper_game.Game.generate_grid, rows, cols, mines)
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_reveal_coordinate(bench, mode: int):
+    def setup():
+        g = saper_game.create_game(mode)
+        return (g, *random.choice(_safe_cells(g)))
+
+    bench(saper_game.Game.reveal_coordinate, setup=setup)
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_render_final_field(bench, mode: int):
+    record = saper_game.GameRecord.from_game(_play_to_the_end(saper_game.create_game(mode)))
+    bench(keyboard_generator.render_final_field, record)
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_render_game_keyboard(bench, mode: int):
+    render = keyboard_generator.RenderInlineGameKeyboard()
+    bench(render, button_texts.TEXTS["en"], saper_game.create_game(mode))
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_render_game_keyboard_after_move(bench, mode: int):
+    render = keyboard_generator.RenderInlineGameKeyboard()
+    texts = button_texts.TEXTS["en"]
+
+    def setup():
+        g = saper_game.create_game(mode)
+        render(texts, g)
+        return texts, g, g.reveal_coordinate(*random.choice(_safe_cells(g)))
+
+    bench(render, setup=setup)
+
+
+@pytest.mark.parametrize('board', [(8, 8, 6, 3), (11, 8, 30, 1), (30, 30, 150, 1), (100, 100, 3000, 1)])
+@pytest.mark.parametrize('flood_fill', [False, True])
+def test_full_game(bench, board: typing.Tuple[int, int, int, int], flood_fill: bool):
+    """
+    Reveals every safe cell of a new game
+    """
+    g = bench(_play_to_the_end, setup=lambda: (saper_game.Game(*board, flood_fill=flood_fill),))
+    assert g.cells_opened == g.config.rows * g.config.cols - g.config.explosives_count
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_solve(bench, mode: int):
+    def setup():
+        g = saper_game.create_game(mode)
+        return g.config.rows, g.config.cols, g.mines, sum(1 << i for i, value in enumerate(g.opened) if value)
+
+    bench(solver.solve, setup=setup)
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_create_game_no_guess(bench, mode: int):
+    bench(saper_game.create_game, mode, no_guess=True)
@@ -1,9 +1,16 @@
+import asyncio
+import collections
+import contextlib
 import dataclasses
+import itertools
+import os
 import typing
 import dill
 
 import aiogram
 
+from bot.game import saper_game
+
 
 @dataclasses.dataclass
 class User:
@@ -16,6 +23,164 @@ class User:
     def __post_init__(self):
         self.prefered_language: str = self.tg_user.language_code.lower()
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # older versions kept whole Game objects in history
+        self.game_history = [saper_game.GameRecord.from_game(g) if isinstance(g, saper_game.Game) else g
+                             for g in self.game_history]
+
+
+class Leaderboard:
+    """
+    Rank index of users by max score, kept up to date on every score change.
+    Numbers of users per score are stored in a Fenwick tree, so rank and top lookups cost O(log max_score).
+    Users with equal score share a rank and are listed in the order they reached it.
+    Scores are mirrored to the `scores` mapping, so the index is rebuilt from it in a single pass on start.
+    """
+
+    def __init__(self, scores: typing.MutableMapping[int, int]):
+        self.scores = scores
+        self._user_score: typing.Dict[int, int] = {}
+        self._by_score: typing.Dict[int, typing.Dict[int, None]] = {}
+        self._tree = [0] * 1025
+        for user_id, score in scores.items():
+            self._user_score[user_id] = score
+            self._by_score.setdefault(score, {})[user_id] = None
+        # the tree is built from the counts per score at once instead of adding users one by one
+        self._grow(max(self._by_score, default=0))
+
+    def __len__(self):
+        return len(self._user_score)
+
+    def update(self, user_id: int, score: int):
+        if self._user_score.get(user_id) == score:
+            return
+        if user_id in self._user_score:
+            old_score = self._user_score[user_id]
+            self._add(old_score, -1)
+            del self._by_score[old_score][user_id]
+            if not self._by_score[old_score]:
+                del self._by_score[old_score]
+        self._insert(user_id, score)
+        self.scores[user_id] = score
+
+    def rank(self, user_id: int) -> int:
+        """
+        1-based position of the user, users with the same score share it
+        """
+        return len(self._user_score) - self._count_le(self._user_score[user_id]) + 1
+
+    def top(self, n: int = 10) -> typing.List[int]:
+        """
+        Ids of n users with the highest scores
+        """
+        result = []
+        total = len(self._user_score)
+        while len(result) < n and len(result) < total:
+            # score of the (total - len(result))-th user in ascending order is the next highest one
+            bucket = self._by_score[self._find(total - len(result))]
+            result.extend(itertools.islice(bucket, n - len(result)))
+        return result
+
+    async def record(self, user_id: int, score: int):
+        """
+        update for handlers, same coroutine as in storage.RedisLeaderboard
+        """
+        self.update(user_id, score)
+
+    async def standings(self, user_id: int, n: int = 10) -> typing.Tuple[typing.List[int], int]:
+        """
+        top(n) and rank of the user
+        """
+        return self.top(n), self.rank(user_id)
+
+    def _insert(self, user_id: int, score: int):
+        self._add(score, 1)
+        self._user_score[user_id] = score
+        self._by_score.setdefault(score, {})[user_id] = None
+
+    def _add(self, score: int, delta: int):
+        if score + 1 >= len(self._tree):
+            self._grow(score)
+        i = score + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _grow(self, score: int):
+        size = len(self._tree) - 1
+        while size <= score:
+            size *= 2
+        self._tree = [0] * (size + 1)
+        for bucket_score, bucket in self._by_score.items():
+            i = bucket_score + 1
+            while i < len(self._tree):
+                self._tree[i] += len(bucket)
+                i += i & -i
+
+    def _count_le(self, score: int) -> int:
+        i, count = min(score + 1, len(self._tree) - 1), 0
+        while i > 0:
+            count += self._tree[i]
+            i -= i & -i
+        return count
+
+    def _find(self, k: int) -> int:
+        """
+        Smallest score such that k users have a score less or equal to it
+        """
+        pos, step = 0, 1 << (len(self._tree) - 1).bit_length() - 1
+        while step:
+            if pos + step < len(self._tree) and self._tree[pos + step] < k:
+                pos += step
+                k -= self._tree[pos]
+            step >>= 1
+        return pos
+
+
+class KeyedLock:
+    """
+    FIFO asyncio lock per key, e.g. per user. Locks are created on demand and dropped when nobody holds them.
+    stats: acquired - total acquisitions, contended - acquisitions that had to wait,
+    max_depth - the longest queue (holder included) seen for a single key.
+    """
+
+    def __init__(self):
+        self._locks: typing.Dict[typing.Hashable, asyncio.Lock] = {}
+        self._depth: typing.Dict[typing.Hashable, int] = {}
+        self.stats: typing.Counter[str] = collections.Counter()
+
+    def depth(self, key: typing.Hashable) -> int:
+        """
+        Number of tasks holding or waiting for the key
+        """
+        return self._depth.get(key, 0)
+
+    @property
+    def waiting(self) -> int:
+        """
+        Number of tasks waiting for any key
+        """
+        return sum(self._depth.values()) - len(self._depth)
+
+    @contextlib.asynccontextmanager
+    async def __call__(self, key: typing.Hashable):
+        depth = self._depth.get(key, 0) + 1
+        self._depth[key] = depth
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self.stats["acquired"] += 1
+        if depth > 1:
+            self.stats["contended"] += 1
+        self.stats["max_depth"] = max(self.stats["max_depth"], depth)
+        try:
+            async with lock:
+                yield
+        finally:
+            self._depth[key] -= 1
+            if self._depth[key] == 0:
+                del self._depth[key]
+                del self._locks[key]
+
 
 class Storage:
     def __init__(self, path):
@@ -37,5 +202,10 @@ class Storage:
         return self.storage
 
     def close(self):
-        with open(self.path, "wb") as f:
-            dill.dump(self.storage, f)
\ No newline at end of file
+        # the old file stays in place until the new one is fully on disk, a crash mid-dump does not corrupt it
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            dill.dump(self.storage, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
\ No newline at end of file
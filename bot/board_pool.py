@@ -0,0 +1,99 @@
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import logging
+import typing
+
+from bot import metrics
+from bot.game import saper_game
+
+pool_requests = metrics.Counter("bot_board_pool_requests_total", "Games taken from the board pool, result is hit or miss",
+                                ["mode", "result"])
+no_guess_fallbacks = metrics.Counter("bot_no_guess_fallbacks_total",
+                                     "No-guess games served with a board which needs guessing", ["mode"])
+
+
+class BoardPool:
+    """
+    Keeps up to size ready games for every difficulty mode, so /play does not generate a board on the event loop.
+    Boards are generated by a background task in executor, the default thread pool if it is None.
+    A process pool makes sense with no_guess, generation of a hard no-guess board is CPU bound.
+    """
+
+    def __init__(self, size: int = 20, modes: typing.Iterable[int] = (0, 1, 2, 3), no_guess: bool = False,
+                 flood_fill: bool = True, executor: typing.Optional[concurrent.futures.Executor] = None):
+        self.size = size
+        self.no_guess = no_guess
+        self.flood_fill = flood_fill
+        self.executor = executor
+        self.stats: typing.Counter[str] = collections.Counter()
+        self._boards: typing.Dict[int, typing.Deque[saper_game.Game]] = {mode: collections.deque() for mode in modes}
+        self._wakeup = asyncio.Event()
+        self._task: typing.Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return sum(map(len, self._boards.values()))
+
+    def _create(self, mode: int) -> typing.Callable[[], saper_game.Game]:
+        # partial of a module level function can be sent to a process pool
+        return functools.partial(saper_game.create_game, mode, self.flood_fill, None, self.no_guess)
+
+    @property
+    def modes(self) -> typing.Tuple[int, ...]:
+        return tuple(self._boards)
+
+    async def get(self, mode: int) -> saper_game.Game:
+        """
+        Pops a ready game in O(1). On a miss a no-guess game is generated in the executor,
+        a plain board takes less time than a hop to a thread and is generated right away.
+        Raises ValueError for a mode the pool does not serve.
+        """
+        boards = self._boards.get(mode)
+        if boards is None:
+            raise ValueError(f"Unknown mode {mode!r}")
+        if boards:
+            result = "hit"
+            g = boards.popleft()
+        elif self.no_guess:
+            result = "miss"
+            g = await asyncio.get_running_loop().run_in_executor(self.executor, self._create(mode))
+        else:
+            result = "miss"
+            g = self._create(mode)()
+        self.stats[result] += 1
+        pool_requests.inc(mode=str(mode), result=result)
+        if self.no_guess and not g.config.no_guess:
+            no_guess_fallbacks.inc(mode=str(mode))
+        self._wakeup.set()
+        return g
+
+    def start(self):
+        """
+        Starts refilling in the running event loop
+        """
+        if self.size > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._refill())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _refill(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            # one board per mode at a time, so a slow mode does not starve the others
+            missing = [mode for mode, boards in self._boards.items() if len(boards) < self.size]
+            if not missing:
+                await self._wakeup.wait()
+                continue
+            try:
+                for mode in missing:
+                    self._boards[mode].append(await loop.run_in_executor(self.executor, self._create(mode)))
+            except Exception:
+                logging.exception("board pool refill failed")
+                await asyncio.sleep(1)
@@ -1,6 +1,7 @@
 import abc
+import typing
 
-from bot import additional_classes
+from bot import additional_classes, locales
 
 
 class BaseKeyboardButtonsTexts(abc.ABC):
@@ -29,59 +30,61 @@ class BaseKeyboardButtonsTexts(abc.ABC):
         raise NotImplemented
 
     @abc.abstractmethod
-    def leaderboard(self):
+    def game_replay(self):
         raise NotImplemented
 
+    @abc.abstractmethod
+    def leaderboard(self):
+        raise NotImplemented
 
-class EnglishKeyboardButtonsTexts(BaseKeyboardButtonsTexts):
-    def main_menu(self):
-        return ["Play", "Profile", "Statistics", "Leaderboard"]
-
-    def play(self):
-        return ["Easy", "Medium", "Hard", "Impossible", "Main Menu"]
-
-    def profile(self):
-        return ["Language", "Main Menu"]
-
-    def language(self):
-        return ["English", "Russian"]
-
-    def statistics(self):
-        return ["Game History", "Main Menu"]
-
-    def game_history(self):
-        return ["Previous", "Next", "Main Menu"]
 
-    def leaderboard(self):
-        return ["Main Menu"]
+class CatalogKeyboardButtonsTexts(BaseKeyboardButtonsTexts):
+    """
+    Button texts of one language read from its catalog. Every method returns the same list on every call,
+    the lists are shared and must not be changed.
+    """
 
+    def __init__(self, buttons: typing.Dict[str, typing.Any]):
+        self._main_menu = buttons["main_menu"]
+        self._play = buttons["play"]
+        self._profile = buttons["profile"]
+        # every language is shown by its own name, in the order of locales.catalogs()
+        self._language = [catalog["language_name"] for catalog in locales.catalogs().values()]
+        self._statistics = buttons["statistics"]
+        self._game_history = buttons["game_history"]
+        self._game_replay = buttons["game_replay"]
+        self._leaderboard = buttons["leaderboard"]
 
-class RussianKeyboardButtonsTexts(BaseKeyboardButtonsTexts):
     def main_menu(self):
-        return ["Играть", "Профиль", "Статистика", "Рейтинг игроков"]
+        return self._main_menu
 
     def play(self):
-        return ["Легко", "Средне", "Сложно", "Невозможно", "Главное Меню"]
+        return self._play
 
     def profile(self):
-        return ["Язык", "Главное Меню"]
+        return self._profile
 
     def language(self):
-        return ["Английский", "Русский"]
+        return self._language
 
     def statistics(self):
-        return ["История Игр", "Главное Меню"]
+        return self._statistics
 
     def game_history(self):
-        return ["Назад", "Вперед", "Главное Меню"]
+        return self._game_history
+
+    def game_replay(self):
+        return self._game_replay
 
     def leaderboard(self):
-        return ["Главное Меню"]
+        return self._leaderboard
+
+
+# keyboard_generator caches static keyboards per instance, so every language has exactly one
+TEXTS: typing.Dict[str, BaseKeyboardButtonsTexts] = {
+    code: CatalogKeyboardButtonsTexts(catalog["buttons"]) for code, catalog in locales.catalogs().items()
+}
 
 
-def get_keyboard_buttons_texts(user: additional_classes.User):
-    match user.prefered_language:
-        case "ru":
-            return RussianKeyboardButtonsTexts()
-        case _:
-            return EnglishKeyboardButtonsTexts()
+def get_keyboard_buttons_texts(user: additional_classes.User) -> BaseKeyboardButtonsTexts:
+    return TEXTS.get(user.prefered_language, TEXTS[locales.DEFAULT_LANGUAGE])
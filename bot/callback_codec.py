@@ -0,0 +1,39 @@
+"""
+Callback data of game buttons: "g.<version><payload>".
+Version 1 payload is urlsafe base64 of the game id and the cell coordinates, 8 characters in total.
+Version 0 is the "g.{row}.{col}" text of keyboards sent before game ids existed, it is decoded with LEGACY_GAME_ID.
+"""
+import base64
+import binascii
+import struct
+import typing
+
+GAME_PREFIX = "g"
+VERSION = "1"
+# game id of games started before ids existed
+LEGACY_GAME_ID = 0
+# game id, row, col
+_CELL = struct.Struct(">IBB")
+_PAYLOAD_LENGTH = len(VERSION) + len(base64.urlsafe_b64encode(bytes(_CELL.size)))
+
+
+def encode_cell(game_id: int, row: int, col: int) -> str:
+    return f"{GAME_PREFIX}.{VERSION}{base64.urlsafe_b64encode(_CELL.pack(game_id, row, col)).decode()}"
+
+
+def decode_cell(args: typing.Sequence[str]) -> typing.Tuple[int, int, int]:
+    """
+    Returns game id, row and col from the arguments following GAME_PREFIX, raises ValueError for malformed data
+    """
+    if len(args) == 1:
+        payload = args[0]
+        if len(payload) != _PAYLOAD_LENGTH or not payload.startswith(VERSION):
+            raise ValueError(f"Unsupported game callback data {payload!r}")
+        try:
+            return _CELL.unpack(base64.urlsafe_b64decode(payload[len(VERSION):]))
+        except (binascii.Error, struct.error) as e:
+            raise ValueError(f"Malformed game callback data {payload!r}") from e
+    if len(args) == 2:
+        row, col = map(int, args)
+        return LEGACY_GAME_ID, row, col
+    raise ValueError(f"Malformed game callback data {args!r}")
@@ -1,7 +1,14 @@
 import dataclasses
+import functools
+import itertools
+import logging
 import random
+import sys
+import time
 import typing
 
+from bot.game import solver
+
 
 @dataclasses.dataclass
 class Event:
@@ -23,19 +30,166 @@ class GameConfig:
     cols: int
     explosives_count: int
     lives: int
+    mode: typing.Optional[int] = None
+    flood_fill: bool = False
+    no_guess: bool = False
+
+
+MINE = 9
+# boards generated for a no-guess game, each one is repaired by up to NO_GUESS_REPAIR_MOVES moves of a mine
+NO_GUESS_ATTEMPTS = 50
+NO_GUESS_REPAIR_MOVES = 100
+# symbol of an opened cell by its value in Game.cells
+OPENED_SYMBOLS = ("0", "1", "2", "3", "4", "5", "6", "7", "8", "b")
+# byte k of _SPREAD[b] is bit k of b, used to unpack a bitboard into one byte per cell
+_SPREAD = tuple(bytes((b >> k) & 1 for k in range(8)) for b in range(256))
+# maps bytes 0 and 1 to ascii digits
+_BIT_DIGITS = bytes.maketrans(b"\x00\x01", b"01")
+
+
+def _move_size(rows: int, cols: int) -> int:
+    """
+    Bytes taken by one move in the move log, a move is the flat index of the revealed cell
+    """
+    return max(1, ((rows * cols - 1).bit_length() + 7) // 8)
+
+
+@functools.lru_cache(maxsize=64)
+def neighbours(rows: int, cols: int) -> typing.Tuple[typing.Tuple[int, ...], ...]:
+    """
+    Flat indices of the neighbours of every cell, cells outside of the board are already left out.
+    The table is shared by all games of the same shape.
+    """
+    table = []
+    for x in range(rows):
+        for y in range(cols):
+            table.append(tuple(nx * cols + ny for nx in range(max(x - 1, 0), min(x + 2, rows))
+                               for ny in range(max(y - 1, 0), min(y + 2, cols)) if (nx, ny) != (x, y)))
+    return tuple(table)
+
+
+@functools.lru_cache(maxsize=None)
+def _column_masks(rows: int, cols: int) -> typing.Tuple[int, int, int]:
+    """
+    Bitboards of the whole grid, of every column except the first one and of every column except the last one
+    """
+    first_col = sum(1 << (row * cols) for row in range(rows))
+    full = (1 << (rows * cols)) - 1
+    return full, full & ~first_col, full & ~(first_col << (cols - 1))
+
+
+def _unpack_bitboard(board: int, size: int) -> int:
+    """
+    Moves bit i of the board to the lowest bit of byte i
+    """
+    return int.from_bytes(b"".join(map(_SPREAD.__getitem__, board.to_bytes((size + 7) // 8, "little"))), "little")
 
 
 class Game:
-    def __init__(self, rows: int, cols: int, explosives_count: int, lives: int):
+    """
+    Cells are stored row by row in flat arrays, cell (x, y) has index x * cols + y.
+    cells holds number of neighbouring mines or MINE, opened is 1 for every opened cell.
+    moves is the append-only log of revealed cells, together with mines, start and start_config it is enough
+    to rebuild the game at any move with Game.replay.
+    """
+
+    def __init__(self, rows: int, cols: int, explosives_count: int, lives: int, mode: typing.Optional[int] = None,
+                 flood_fill: bool = False, seed: typing.Optional[int] = None, no_guess: bool = False,
+                 board: typing.Optional[typing.Tuple[int, int]] = None):
+        """
+        The board is generated by random.Random(seed), games with the same seed and config are equal.
+        Without seed a random one is chosen and kept in self.seed.
+        game_id tells buttons of this game from buttons of the player's older games, it is never 0.
+        A random start cell and its neighbours are free of mines and opened.
+        With no_guess boards are generated and repaired until the solver clears one from the start cell,
+        if none is found config.no_guess is False.
+        board - mines bitboard and start cell of an existing game, nothing is generated then.
+        """
         if explosives_count <= lives:
             raise ValueError("Explosives should be less then lives")
-        explosive_coordinates = self.generate_random_explosives(rows, cols, explosives_count)
+        self.seed = random.getrandbits(64) if seed is None else seed
+        self.game_id = (self.seed & 0xFFFFFFFF) or 1
+        if board is None:
+            self.mines, self.start, no_guess = self.generate_board(rows, cols, explosives_count,
+                                                                   random.Random(self.seed), no_guess)
+        else:
+            self.mines, self.start = board
         self.score = 0
         self.cells_opened = 0
         self.bombs_detonated = 0
-        self.config = GameConfig(rows=rows, cols=cols, explosives_count=explosives_count, lives=lives)
-        self.grid = self.generate_grid(rows, cols, explosive_coordinates)
-        self.public_grid = self.generate_public_grid(rows, cols, self.grid)
+        self.config = GameConfig(rows=rows, cols=cols, explosives_count=explosives_count, lives=lives, mode=mode,
+                                 flood_fill=flood_fill, no_guess=no_guess)
+        self.cells = self.generate_grid(rows, cols, self.mines)
+        self.opened = self.generate_public_grid(rows, cols, self.cells, self.start)
+        self.moves = bytearray()
+        self.move_size = _move_size(rows, cols)
+
+    @classmethod
+    def generate_board(cls, rows: int, cols: int, explosives_count: int, rng: random.Random,
+                       no_guess: bool = False) -> typing.Tuple[int, int, bool]:
+        """
+        Returns the mines bitboard, the start cell and whether the board can be cleared without guessing,
+        which is only checked with no_guess
+        """
+        start = rng.randrange(rows * cols)
+        start_area = (start, *neighbours(rows, cols)[start])
+        for _ in range(NO_GUESS_ATTEMPTS if no_guess else 1):
+            explosive_coordinates = cls.generate_random_explosives(rows, cols, explosives_count, rng,
+                                                                   exclude=start_area)
+            mines = 0
+            for x, y in explosive_coordinates:
+                mines |= 1 << (x * cols + y)
+            if not no_guess:
+                return mines, start, False
+            solvable = solver.make_solvable(rows, cols, mines, sum(1 << i for i in start_area) & ~mines, rng,
+                                            NO_GUESS_REPAIR_MOVES)
+            if solvable is not None:
+                return solvable, start, True
+        logging.warning("no-guess board %sx%s with %s mines not found in %s attempts",
+                        rows, cols, explosives_count, NO_GUESS_ATTEMPTS)
+        return mines, start, False
+
+    @property
+    def start_config(self) -> GameConfig:
+        """
+        Config the game was created with, config.lives is decreased by every detonated bomb
+        """
+        return dataclasses.replace(self.config, lives=self.config.lives + self.bombs_detonated)
+
+    @classmethod
+    def replay(cls, config: GameConfig, board: typing.Tuple[int, int], moves: bytes,
+               count: typing.Optional[int] = None, seed: typing.Optional[int] = None) -> "Game":
+        """
+        Creates the game from config and board (mines bitboard and start cell) and repeats first count moves of the log,
+        all moves by default. The board is not generated again, so replays do not depend on the generator.
+        """
+        g = cls(config.rows, config.cols, config.explosives_count, config.lives, mode=config.mode,
+                flood_fill=config.flood_fill, seed=seed, no_guess=config.no_guess, board=board)
+        size = g.move_size
+        end = len(moves) if count is None else min(len(moves), count * size)
+        for i in range(0, end, size):
+            g.reveal_coordinate(*divmod(int.from_bytes(moves[i:i + size], "little"), config.cols))
+        return g
+
+    @property
+    def grid(self) -> typing.List[typing.List[int]]:
+        """
+        Number of neighbouring mines for every cell, -1 for mines
+        """
+        cols = self.config.cols
+        return [[-1 if value == MINE else value for value in self.cells[row * cols:(row + 1) * cols]]
+                for row in range(self.config.rows)]
+
+    @property
+    def public_grid(self) -> typing.List[typing.List[str]]:
+        """
+        Grid as it is shown to the player: "*" - closed, "b" - detonated bomb, digit - opened
+        """
+        return [[self.public_cell(row, col) for col in range(self.config.cols)] for row in range(self.config.rows)]
+
+    def public_cell(self, row: int, col: int) -> str:
+        idx = row * self.config.cols + col
+        return OPENED_SYMBOLS[self.cells[idx]] if self.opened[idx] else "*"
 
     def reveal_coordinate(self, x: int, y: int):
         """
@@ -45,85 +199,233 @@ class Game:
         3 - cell already opeded
         4 - bomb in cell
         5 - lose
+        With config.flood_fill opening a zero cell opens its whole zero region with the border,
+        all opened cells are listed in Event.opened_coordinates.
         """
-        if x < 0 or y < 0 or x > self.config.rows or y > self.config.cols:
+        if not (0 <= x < self.config.rows and 0 <= y < self.config.cols):
             raise ValueError("Coordinates must be within grid")
-        value = self.grid[x][y]
-        if value != -1 and self.public_grid[x][y] != str(value):
-            self.score = self.score + value + 1 + \
-                         (value * ((self.config.explosives_count // (self.config.lives + 1)) - 1))
-            self.public_grid[x][y] = str(value)
-            self.cells_opened += 1
+        idx = x * self.config.cols + y
+        value = self.cells[idx]
+        if self.opened[idx]:
+            return Event(msg="This cell was already opened", status_code=3, opened_coordinates=[(x, y)])
+        self.moves += idx.to_bytes(self.move_size, "little")
+        if value != MINE:
+            opened = self.flood_fill(idx) if self.config.flood_fill and value == 0 else [idx]
+            multiplier = (self.config.explosives_count // (self.config.lives + 1)) - 1
+            for i in opened:
+                self.opened[i] = 1
+                self.score = self.score + self.cells[i] + 1 + self.cells[i] * multiplier
+            self.cells_opened += len(opened)
+            opened_coordinates = [divmod(i, self.config.cols) for i in opened]
             if self.cells_opened >= self.config.rows * self.config.cols - self.config.explosives_count:
-                return Event(msg="Congratulations! You won!", game_over=True, status_code=1, opened_coordinates=[x, y])
-            return Event(msg="Great! No bomb here!", status_code=2, opened_coordinates=[x, y])
-        elif self.public_grid[x][y] == str(value) or self.public_grid[x][y] == "b":
-            return Event(msg="This cell was already opened", status_code=3, opened_coordinates=[x, y])
-        else:
-            self.config.lives -= 1
-            self.bombs_detonated += 1
-            self.public_grid[x][y] = "b"
-            if self.config.lives <= 0 or self.bombs_detonated >= self.config.explosives_count:
-                return Event(msg="Game Over...", game_over=True, status_code=5, opened_coordinates=[x, y])
-            return Event(msg=f"Booom! You have {self.config.lives} lives left...", status_code=4, opened_coordinates=[x, y])
-
-    def generate_public_grid(self, rows: int, cols: int,
-                             grid: typing.List[typing.List[int]]) -> typing.List[typing.List[int]]:
-        public_grid = [["*"] * cols for _ in range(rows)]
-        x, y = random.randrange(0, rows), random.randrange(0, cols)
+                return Event(msg="Congratulations! You won!", game_over=True, status_code=1,
+                             opened_coordinates=opened_coordinates)
+            return Event(msg="Great! No bomb here!", status_code=2, opened_coordinates=opened_coordinates)
+        self.opened[idx] = 1
+        self.config.lives -= 1
+        self.bombs_detonated += 1
+        if self.config.lives <= 0 or self.bombs_detonated >= self.config.explosives_count:
+            return Event(msg="Game Over...", game_over=True, status_code=5, opened_coordinates=[(x, y)])
+        return Event(msg=f"Booom! You have {self.config.lives} lives left...", status_code=4,
+                     opened_coordinates=[(x, y)])
+
+    def flood_fill(self, start: int) -> typing.List[int]:
+        """
+        Closed cells of the zero region containing start together with its border.
+        Uses an explicit stack, so region size is not limited by recursion depth.
+        """
+        table = neighbours(self.config.rows, self.config.cols)
+        opened, cells = self.opened, self.cells
+        region = [start]
+        seen = {start}
+        stack = [start]
+        while stack:
+            for i in table[stack.pop()]:
+                if i not in seen and not opened[i]:
+                    seen.add(i)
+                    region.append(i)
+                    if cells[i] == 0:
+                        stack.append(i)
+        return region
+
+    def generate_public_grid(self, rows: int, cols: int, cells: bytearray, start: int) -> bytearray:
+        """
+        Opens the start cell and its neighbours except mines, they are only there on boards too dense to avoid it
+        """
+        opened = bytearray(rows * cols)
         c = 0
-        for nx, ny in ((x - 1, y), (x + 1, y), (x - 1, y - 1), (x + 1, y + 1), (x - 1, y + 1), (x + 1, y - 1), (x, y - 1), (x, y + 1)):
-            if 0 <= nx < rows and 0 <= ny < cols and grid[nx][ny] != -1:
-                public_grid[nx][ny] = str(grid[nx][ny])
+        for i in (start, *neighbours(rows, cols)[start]):
+            if cells[i] != MINE:
+                opened[i] = 1
                 c += 1
         self.cells_opened += c
-        return public_grid
+        return opened
 
     @classmethod
-    def generate_grid(cls, rows: int, cols: int,
-                      explosive_coordinates: typing.List[typing.Tuple[int]]) -> typing.List[typing.List[int]]:
-        grid = [[0] * cols for _ in range(rows)]
-        for x, y in explosive_coordinates:
-            grid[x][y] = -1
-            for nx, ny in (
-                    (x - 1, y), (x + 1, y), (x - 1, y - 1), (x + 1, y + 1), (x - 1, y + 1), (x + 1, y - 1), (x, y - 1),
-                    (x, y + 1)
-            ):
-                if 0 <= nx < rows and 0 <= ny < cols and grid[nx][ny] != -1:
-                    grid[nx][ny] += 1
-        return grid
+    def generate_grid(cls, rows: int, cols: int, mines: int) -> bytearray:
+        """
+        Counts neighbouring mines of all cells at once: the mines bitboard is shifted towards each of 8 directions
+        and the shifted boards are summed up bit-parallel into 4 bit planes.
+        """
+        full, not_first_col, not_last_col = _column_masks(rows, cols)
+        planes = [0, 0, 0, 0]
+        for shifted in (
+                mines >> cols, (mines << cols) & full,
+                (mines >> 1) & not_last_col, (mines << 1) & not_first_col,
+                (mines >> (cols + 1)) & not_last_col, (mines >> (cols - 1)) & not_first_col,
+                (mines << (cols - 1)) & not_last_col, (mines << (cols + 1)) & not_first_col,
+        ):
+            carry = shifted
+            for i in range(4):
+                planes[i], carry = planes[i] ^ carry, planes[i] & carry
+        size = rows * cols
+        counts = sum(_unpack_bitboard(plane, size) << i for i, plane in enumerate(planes))
+        mine_cells = _unpack_bitboard(mines, size)
+        counts = (counts & ~(mine_cells * 0xFF)) | (mine_cells * MINE)
+        return bytearray(counts.to_bytes((size + 7) // 8 * 8, "little")[:size])
 
     @classmethod
-    def generate_random_explosives(cls, rows: int, cols: int, explosives_count: int) -> typing.List[typing.Tuple[int]]:
-        explosive_coordinates = []
-        used_x_y = set()
-        c = 0
-        while c < explosives_count and c < rows * cols:
-            x, y = random.randrange(0, rows), random.randrange(0, cols)
-            if f"{x}.{y}" not in used_x_y:
-                used_x_y.add(f"{x}.{y}")
-                explosive_coordinates.append((x, y))
-                c += 1
-        return explosive_coordinates
+    def generate_random_explosives(cls, rows: int, cols: int, explosives_count: int,
+                                   rng: typing.Optional[random.Random] = None,
+                                   exclude: typing.Collection[int] = ()) -> typing.List[typing.Tuple[int, int]]:
+        """
+        Distinct cells sampled without rejection, so time depends only on explosives_count and not on the density.
+        Flat indices from exclude get no mine unless there are not enough other cells.
+        """
+        if not 0 <= explosives_count <= rows * cols:
+            raise ValueError("Explosives count must be within 0 and number of cells")
+        if explosives_count > rows * cols - len(exclude):
+            exclude = ()
+        excluded = sorted(exclude)
+        indices = (rng or random).sample(range(rows * cols - len(excluded)), explosives_count)
+        if excluded:
+            # shift sampled indices over the excluded ones, k-th allowed cell gets index k
+            for n, i in enumerate(indices):
+                for e in excluded:
+                    if i >= e:
+                        i += 1
+                indices[n] = i
+        return [divmod(i, cols) for i in indices]
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault("seed", None)
+        self.__dict__.setdefault("moves", bytearray())
+        # games started before ids existed
+        self.__dict__.setdefault("game_id", 0)
+        self.__dict__.setdefault("move_size", _move_size(self.config.rows, self.config.cols))
+        self.__dict__.setdefault("start", None)
+        if "grid" in state:
+            # games pickled by older versions kept nested lists of ints and strings
+            grid, public_grid = self.__dict__.pop("grid"), self.__dict__.pop("public_grid")
+            self.cells = bytearray(MINE if value == -1 else value for row in grid for value in row)
+            self.opened = bytearray(value != "*" for row in public_grid for value in row)
+            self.mines = sum(1 << i for i, value in enumerate(self.cells) if value == MINE)
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sum(map(sys.getsizeof, (self.__dict__, self.config, self.mines, self.cells,
+                                                                  self.opened, self.moves)))
 
     def __repr__(self):
         return f"score: {self.score} - cells_opened: {self.cells_opened}"
 
 
-def create_game(mode: int = 1):
+@dataclasses.dataclass(frozen=True, slots=True)
+class GameRecord:
+    """
+    Compact snapshot of a finished game kept in the user's history.
+    Mines and opened cells are stored as bitmasks, bit row * cols + col describes a cell.
+    Records with a seed keep the move log and the start cell of the game and can be replayed move by move.
+    """
+    rows: int
+    cols: int
+    mines: bytes
+    opened: bytes
+    score: int
+    won: bool
+    mode: typing.Optional[int] = None
+    finished_at: float = dataclasses.field(default_factory=time.time)
+    explosives_count: int = 0
+    lives: int = 0
+    flood_fill: bool = False
+    seed: typing.Optional[int] = None
+    moves: bytes = b""
+    no_guess: bool = False
+    start: typing.Optional[int] = None
+
+    @classmethod
+    def from_game(cls, g: Game) -> "GameRecord":
+        rows, cols = g.config.rows, g.config.cols
+        opened = int(g.opened[::-1].translate(_BIT_DIGITS), 2)
+        size = (rows * cols + 7) // 8
+        config = g.start_config
+        return cls(rows=rows, cols=cols, mines=g.mines.to_bytes(size, "little"), opened=opened.to_bytes(size, "little"),
+                   score=g.score, won=g.config.lives > 0, mode=config.mode, explosives_count=config.explosives_count,
+                   lives=config.lives, flood_fill=config.flood_fill, seed=g.seed, moves=bytes(g.moves),
+                   no_guess=config.no_guess, start=g.start)
+
+    def __setstate__(self, state):
+        # records pickled before a field was added have a shorter state, missing fields get their defaults
+        for field, value in itertools.zip_longest(dataclasses.fields(self), state, fillvalue=dataclasses.MISSING):
+            if value is dataclasses.MISSING:
+                value = field.default if field.default_factory is dataclasses.MISSING else field.default_factory()
+            object.__setattr__(self, field.name, value)
+
+    @property
+    def move_count(self) -> int:
+        return len(self.moves) // _move_size(self.rows, self.cols)
+
+    def replay(self, count: typing.Optional[int] = None) -> Game:
+        """
+        Game after first count moves, raises ValueError for records without seed
+        """
+        if self.seed is None:
+            raise ValueError("Game without move log can not be replayed")
+        start = self.start
+        if start is None:
+            # records saved before the start cell was stored, it is the first number drawn from the seed
+            start = random.Random(self.seed).randrange(self.rows * self.cols)
+        config = GameConfig(rows=self.rows, cols=self.cols, explosives_count=self.explosives_count, lives=self.lives,
+                            mode=self.mode, flood_fill=self.flood_fill, no_guess=self.no_guess)
+        return Game.replay(config, (int.from_bytes(self.mines, "little"), start), self.moves, count, self.seed)
+
+    @staticmethod
+    def _is_set(bits: bytes, idx: int) -> bool:
+        return bool(bits[idx >> 3] >> (idx & 7) & 1)
+
+    def cell(self, row: int, col: int) -> str:
+        """
+        Returns the cell as it is shown in Game.public_grid: "*" - closed, "b" - detonated bomb, digit - opened
+        """
+        idx = row * self.cols + col
+        if not self._is_set(self.opened, idx):
+            return "*"
+        if self._is_set(self.mines, idx):
+            return "b"
+        return str(sum(self._is_set(self.mines, i) for i in neighbours(self.rows, self.cols)[idx]))
+
+
+def create_game(mode: int = 1, flood_fill: bool = True, seed: typing.Optional[int] = None, no_guess: bool = False):
     """
     mode:
     0 - easy
     1 - normal
     2 - hard
     3 - impossible
+    flood_fill - opening a zero cell opens all connected zero cells and their border
+    seed - games created with the same seed are equal
+    no_guess - the board can be cleared from the start cell without guessing
     """
     match mode:
         case 0:
-            return Game(rows=8, cols=8, explosives_count=6, lives=3)
+            return Game(rows=8, cols=8, explosives_count=6, lives=3, mode=mode, flood_fill=flood_fill,
+                        seed=seed, no_guess=no_guess)
         case 1:
-            return Game(rows=10, cols=8, explosives_count=12, lives=2)
+            return Game(rows=10, cols=8, explosives_count=12, lives=2, mode=mode, flood_fill=flood_fill,
+                        seed=seed, no_guess=no_guess)
         case 2:
-            return Game(rows=10, cols=8, explosives_count=12, lives=1)
+            return Game(rows=10, cols=8, explosives_count=12, lives=1, mode=mode, flood_fill=flood_fill,
+                        seed=seed, no_guess=no_guess)
         case 3:
-            return Game(rows=11, cols=8, explosives_count=30, lives=1)
+            return Game(rows=11, cols=8, explosives_count=30, lives=1, mode=mode, flood_fill=flood_fill,
+                        seed=seed, no_guess=no_guess)
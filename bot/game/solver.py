@@ -0,0 +1,115 @@
+"""
+Deterministic minesweeper solver used to generate boards which can be cleared without guessing.
+Sets of cells are python ints used as bitsets, bit row * cols + col describes a cell.
+"""
+import functools
+import itertools
+import random
+import typing
+
+
+@functools.lru_cache(maxsize=64)
+def neighbour_masks(rows: int, cols: int) -> typing.Tuple[int, ...]:
+    """
+    Bitset of the neighbours of every cell
+    """
+    masks = []
+    for x in range(rows):
+        for y in range(cols):
+            masks.append(sum(1 << (nx * cols + ny) for nx in range(max(x - 1, 0), min(x + 2, rows))
+                             for ny in range(max(y - 1, 0), min(y + 2, cols)) if (nx, ny) != (x, y)))
+    return tuple(masks)
+
+
+def _bits(cells: int) -> typing.Iterator[int]:
+    while cells:
+        low = cells & -cells
+        yield low.bit_length() - 1
+        cells ^= low
+
+
+def solve(rows: int, cols: int, mines: int, opened: int) -> int:
+    """
+    Returns the safe cells a player can open starting from opened without guessing.
+    Every opened cell gives a constraint "unknown neighbours hold n mines", cells are resolved by single constraints,
+    by pairs of constraints where one covers the other one and by the total number of mines.
+    """
+    masks = neighbour_masks(rows, cols)
+    unknown = ((1 << (rows * cols)) - 1) & ~opened
+    revealed = opened & ~mines
+    flagged = 0
+    # opened cells whose neighbours are all resolved
+    done = 0
+    while True:
+        safe = found_mines = 0
+        constraints = []
+        for i in _bits(revealed & ~done):
+            cell_unknown = masks[i] & unknown
+            if not cell_unknown:
+                done |= 1 << i
+                continue
+            need = (masks[i] & mines).bit_count() - (masks[i] & flagged).bit_count()
+            if need == 0:
+                safe |= cell_unknown
+            elif need == cell_unknown.bit_count():
+                found_mines |= cell_unknown
+            else:
+                constraints.append((cell_unknown, need))
+        if not safe and not found_mines:
+            for (cells_a, need_a), (cells_b, need_b) in itertools.permutations(constraints, 2):
+                only_b = cells_b & ~cells_a
+                if not only_b:
+                    continue
+                if cells_a & cells_b == cells_a and need_a == need_b:
+                    safe |= only_b
+                elif need_b - need_a == only_b.bit_count():
+                    found_mines |= only_b
+                    safe |= cells_a & ~cells_b
+        if not safe and not found_mines:
+            mines_left = mines.bit_count() - flagged.bit_count()
+            if mines_left == 0:
+                safe = unknown
+            elif mines_left == unknown.bit_count():
+                found_mines = unknown
+            else:
+                return revealed
+        revealed |= safe
+        flagged |= found_mines
+        unknown &= ~(safe | found_mines)
+        if not unknown:
+            return revealed
+
+
+def is_solvable(rows: int, cols: int, mines: int, opened: int) -> bool:
+    """
+    True if all safe cells can be opened without guessing
+    """
+    return solve(rows, cols, mines, opened) | mines == (1 << (rows * cols)) - 1
+
+
+def make_solvable(rows: int, cols: int, mines: int, opened: int, rng: random.Random,
+                  max_moves: int) -> typing.Optional[int]:
+    """
+    Moves mines one at a time until the board is solvable from opened, returns the new mines or None.
+    Where the solver gets stuck, a mine next to the cleared area is moved to a closed cell away from it,
+    or a mine from away is moved next to the area. The number of mines does not change.
+    """
+    masks = neighbour_masks(rows, cols)
+    full = (1 << (rows * cols)) - 1
+    for _ in range(max_moves + 1):
+        revealed = solve(rows, cols, mines, opened)
+        if revealed | mines == full:
+            return mines
+        frontier = 0
+        for i in _bits(revealed):
+            frontier |= masks[i]
+        frontier &= ~revealed
+        inner = full & ~revealed & ~frontier
+        if frontier & mines and inner & ~mines and (not inner & mines or rng.random() < 0.5):
+            take, put = frontier & mines, inner & ~mines
+        elif inner & mines and frontier & ~mines:
+            take, put = inner & mines, frontier & ~mines
+        else:
+            return None
+        mines ^= 1 << rng.choice(list(_bits(take))) | 1 << rng.choice(list(_bits(put)))
+    return None
@@ -1,26 +1,129 @@
 import abc
+import collections
+import copy
+import dataclasses
 import logging
+import os
 import typing
 
 import aiogram
 import aiogram.types.inline_keyboard
+import aiogram.utils.exceptions
 
 from bot.game import saper_game
-from bot import keyboard_generator, messages, additional_classes, button_texts
-
-
-def load_context():
-    global ustorage, gstorage, user_to_game, users
-    gstorage = additional_classes.Storage("games.pickle")
-    user_to_game = gstorage.load()
-    ustorage = additional_classes.Storage("users.pickle")
-    users = ustorage.load()
-
-
-def close_context():
-    global ustorage, users
-    ustorage.close()
-    gstorage.close()
+from bot import keyboard_generator, messages, additional_classes, button_texts, storage, log_config, metrics, \
+    board_pool, callback_codec, locales
+
+moves_logger = logging.getLogger(log_config.MOVES_LOGGER)
+
+handler_latency = metrics.Histogram("bot_handler_latency_seconds", "Time spent processing an update",
+                                    ["handler", "prefix"])
+handler_errors = metrics.Counter("bot_handler_errors_total", "Updates whose processing raised", ["handler", "prefix"])
+handler_in_flight = metrics.Gauge("bot_handler_in_flight", "Updates being processed, waiting for user lock included")
+telegram_latency = metrics.Histogram("bot_telegram_request_seconds", "Duration of Bot API calls", ["method"])
+
+
+async def _stored_games() -> int:
+    # awaited, so a redis backend is asked without blocking the event loop
+    return await user_to_game.size()
+
+
+metrics.Gauge("bot_stored_games", "Entries in the game store", function=_stored_games)
+metrics.Gauge("bot_user_lock_waiting", "Updates waiting for the lock of their user", function=lambda: user_locks.waiting)
+metrics.Gauge("bot_board_pool_boards", "Ready games in the board pool", function=lambda: len(boards))
+metrics.Gauge("bot_edits_skipped", "Message edits skipped because nothing changed",
+              function=lambda: edit_stats["skipped"])
+
+# replaced with the backend's mappings by load_context
+users: storage.AsyncMapping = storage.MemoryStorage()
+user_to_game: storage.AsyncMapping = storage.MemoryStorage()
+# telegram requests sent, skipped and saved compared to separate text and keyboard edits
+edit_stats: typing.Counter[str] = collections.Counter()
+user_locks = additional_classes.KeyedLock()
+# new games are taken from here, the default pool is empty and generates every game on request
+boards = board_pool.BoardPool(size=0)
+
+
+def load_context(data_dir: str = ".", redis_url: typing.Optional[str] = None,
+                 games_memory_budget: typing.Optional[int] = None, games_idle_ttl: typing.Optional[float] = None):
+    """
+    State is kept in sqlite files in data_dir, or in redis if redis_url is passed,
+    then any number of workers may serve the bot at the same time.
+    Running games use at most games_memory_budget bytes of memory, games idle for games_idle_ttl seconds
+    are moved to the storage and loaded back on the next tap.
+    """
+    global backend, user_to_game, users, leaderboard, user_locks
+    backend = storage.RedisBackend(redis_url) if redis_url else storage.SqliteBackend(data_dir)
+    user_to_game = backend.mapping("games", memory_budget=games_memory_budget, idle_ttl=games_idle_ttl,
+                                   sizeof=keyboard_generator.game_memory_size)
+    users = backend.mapping("users")
+    # one time migration from the dill snapshots used by previous versions
+    for mapping, legacy_path in ((user_to_game, "games.pickle"), (users, "users.pickle")):
+        if len(mapping) == 0:
+            mapping.update(additional_classes.Storage(os.path.join(data_dir, legacy_path)).load())
+            mapping.flush()
+    leaderboard = backend.leaderboard()
+    if len(leaderboard) == 0:
+        for user_id, user in users.items():
+            leaderboard.update(user_id, user.max_score)
+    user_locks = backend.locks
+
+
+def start_board_pool(pool: board_pool.BoardPool):
+    """
+    Must be called from the running event loop
+    """
+    global boards
+    boards = pool
+    boards.start()
+
+
+async def close_context():
+    global user_to_game, users, boards
+    boards.close()
+    await backend.close()
+    users, user_to_game = storage.MemoryStorage(), storage.MemoryStorage()
+    boards = board_pool.BoardPool(size=0)
+
+
+def _markup_changed(old: typing.Optional[aiogram.types.inline_keyboard.InlineKeyboardMarkup],
+                    new: typing.Optional[aiogram.types.inline_keyboard.InlineKeyboardMarkup]) -> bool:
+    return (old.to_python() if old else None) != (new.to_python() if new else None)
+
+
+async def edit_message(message: aiogram.types.Message, text: str,
+                       reply_markup: typing.Optional[aiogram.types.inline_keyboard.InlineKeyboardMarkup] = None):
+    """
+    Edits text and keyboard of the message with a single request, nothing is sent if neither of them changed.
+    Note: telegram removes the keyboard if reply_markup is not passed
+    """
+    # telegram strips surrounding whitespaces of message texts
+    # keyboards are only serialized when the text is the same, moves nearly always change the text
+    if message.text == text.strip() and not _markup_changed(message.reply_markup, reply_markup):
+        edit_stats["skipped"] += 1
+        edit_stats["saved"] += 2 if reply_markup is not None else 1
+        return
+    try:
+        with telegram_latency.time(method="editMessageText"):
+            await message.edit_text(text, reply_markup=reply_markup)
+    except aiogram.utils.exceptions.MessageNotModified:
+        pass
+    edit_stats["sent"] += 1
+    edit_stats["saved"] += 1 if reply_markup is not None else 0
+
+
+@dataclasses.dataclass(frozen=True)
+class ParsedCallback:
+    """
+    Callback data "prefix.arg1.arg2" split once by CallbackRouter
+    """
+    prefix: str
+    args: typing.Tuple[str, ...] = ()
+
+    @classmethod
+    def parse(cls, data: str) -> "ParsedCallback":
+        prefix, *args = data.split(".")
+        return cls(prefix, tuple(args))
 
 
 class BaseHandler(abc.ABC):
@@ -28,11 +131,36 @@ class BaseHandler(abc.ABC):
         self.user: typing.Optional[additional_classes.User] = None
         self.reply_messages: typing.Optional[messages.BaseMessages] = None
         self.keyboard_buttons: typing.Optional[button_texts.BaseKeyboardButtonsTexts] = None
-
-    async def __call__(self, event: aiogram.types.Message | aiogram.types.CallbackQuery):
-        if event.from_user.id not in users:
-            users[event.from_user.id] = additional_classes.User(tg_user=event.from_user)
-        self.user = users[event.from_user.id]
+        # arguments of the callback data, empty for messages
+        self.args: typing.Tuple[str, ...] = ()
+
+    async def __call__(self, event: aiogram.types.Message | aiogram.types.CallbackQuery,
+                       callback: typing.Optional[ParsedCallback] = None):
+        # one handler instance serves all concurrent updates, so every update is processed by its own copy
+        handler = copy.copy(self)
+        if callback is not None:
+            handler.args = callback.args
+        labels = {"handler": type(self).__name__, "prefix": callback.prefix if callback is not None else "message"}
+        handler_in_flight.inc()
+        try:
+            with handler_latency.time(**labels):
+                # updates of one user are processed one by one in arrival order, different users run in parallel.
+                # The lock is shared by all workers of the backend, so the user's records are read and written atomically
+                async with user_locks(event.from_user.id):
+                    await handler.process(event)
+        except Exception:
+            handler_errors.inc(**labels)
+            raise
+        finally:
+            handler_in_flight.dec()
+
+    async def process(self, event: aiogram.types.Message | aiogram.types.CallbackQuery):
+        # users are loaded lazily, a single lookup reads the record from storage on a cache miss
+        self.user = await users.load(event.from_user.id)
+        if self.user is None:
+            self.user = additional_classes.User(tg_user=event.from_user)
+            await users.store(event.from_user.id, self.user)
+            await leaderboard.record(event.from_user.id, self.user.max_score)
         self.reply_messages = messages.get_language(self.user)
         self.keyboard_buttons = button_texts.get_keyboard_buttons_texts(self.user)
         await self.handle(event)
@@ -45,152 +173,208 @@ class BaseHandler(abc.ABC):
 class StartMessageHandler(BaseHandler):
     async def handle(self, message: aiogram.types.Message):
         keyboard = keyboard_generator.RenderInitialMenu()
-        await message.answer(self.reply_messages.start(), reply_markup=keyboard(self.keyboard_buttons))
+        with telegram_latency.time(method="sendMessage"):
+            await message.answer(self.reply_messages.start(), reply_markup=keyboard(self.keyboard_buttons))
 
 
 class StartMessageInlineHandler(BaseHandler):
     async def handle(self, event: aiogram.types.CallbackQuery):
         keyboard = keyboard_generator.RenderInitialMenu()
-        await event.message.edit_text(self.reply_messages.start())
-        await event.message.edit_reply_markup(keyboard(self.keyboard_buttons))
+        await edit_message(event.message, self.reply_messages.start(), keyboard(self.keyboard_buttons))
 
 
 class MainMenuHandler(BaseHandler):
     async def handle(self, event: aiogram.types.CallbackQuery):
-        match event.data.split(".")[1]:
+        match self.args[0]:
             case "play":
                 keyboard = keyboard_generator.RenderPlayMenu()
-                await event.message.edit_text(self.reply_messages.choose_difficulty())
-                await event.message.edit_reply_markup(keyboard(self.keyboard_buttons))
+                await edit_message(event.message, self.reply_messages.choose_difficulty(),
+                                   keyboard(self.keyboard_buttons))
             case "profile":
                 keyboard = keyboard_generator.RenderProfileMenu()
-                await event.message.edit_text(self.reply_messages.profile_menu())
-                await event.message.edit_reply_markup(keyboard(self.keyboard_buttons))
+                await edit_message(event.message, self.reply_messages.profile_menu(), keyboard(self.keyboard_buttons))
             case "statistics":
                 keyboard = keyboard_generator.RenderStatisticsMenu()
-                await event.message.edit_text(self.reply_messages.statistics_menu(self.user))
-                await event.message.edit_reply_markup(keyboard(self.keyboard_buttons))
+                await edit_message(event.message, self.reply_messages.statistics_menu(self.user),
+                                   keyboard(self.keyboard_buttons))
             case "leaderboard":
                 keyboard = keyboard_generator.RenderLeaderBoardMenu()
-                await event.message.edit_text(self.reply_messages.leaderboard_menu(list(users.values()), self.user))
-                await event.message.edit_reply_markup(keyboard(self.keyboard_buttons))
+                await leaderboard.record(self.user.tg_user.id, self.user.max_score)
+                top_ids, rank = await leaderboard.standings(self.user.tg_user.id, 10)
+                top = await users.load_many(top_ids)
+                await edit_message(event.message, self.reply_messages.leaderboard_menu(top, self.user, rank),
+                                   keyboard(self.keyboard_buttons))
 
 
 class ProfileMenuHandler(BaseHandler):
     async def handle(self, event: aiogram.types.CallbackQuery):
-        match event.data.split(".")[1]:
+        match self.args[0]:
             case "language":
                 keyboard = keyboard_generator.RenderLanguageMenu()
-                await event.message.edit_text(self.reply_messages.language_menu())
-                await event.message.edit_reply_markup(keyboard(self.keyboard_buttons))
+                await edit_message(event.message, self.reply_messages.language_menu(),
+                                   keyboard(self.keyboard_buttons))
 
 
 class LanguageMenuHandler(BaseHandler):
     async def handle(self, event: aiogram.types.CallbackQuery):
-        lang = event.data.split(".")[1]
+        lang = self.args[0]
+        if lang not in locales.catalogs():
+            return
         self.user.prefered_language = lang
-        users[event.from_user.id] = self.user
+        await users.store(event.from_user.id, self.user)
         self.reply_messages = messages.get_language(self.user)
         self.keyboard_buttons = button_texts.get_keyboard_buttons_texts(self.user)
         keyboard = keyboard_generator.RenderProfileMenu()
-        await event.message.edit_text(self.reply_messages.language_changed())
-        await event.message.edit_reply_markup(keyboard(self.keyboard_buttons))
+        await edit_message(event.message, self.reply_messages.language_changed(),
+                           keyboard(self.keyboard_buttons))
 
 
 class StatisticsMenuHandler(BaseHandler):
     async def handle(self, event: aiogram.types.CallbackQuery):
-        match event.data.split(".")[1]:
+        match self.args[0]:
             case "hist":
                 keyboard = keyboard_generator.RenderGameHistoryMenu()
                 # we go from last(-1) to first(-len(v)-1) elements in inverse order
                 if len(self.user.game_history) > 0:
-                    await event.message.edit_text(self.reply_messages.game_history(
+                    await edit_message(event.message, self.reply_messages.game_history(
                         g=self.user.game_history[-1],
-                        field=keyboard_generator.render_final_field(self.user.game_history[-1])))
-                    await event.message.edit_reply_markup(keyboard(self.keyboard_buttons))
+                        field=keyboard_generator.render_final_field(self.user.game_history[-1])),
+                        keyboard(self.keyboard_buttons, replay=self.user.game_history[-1].seed is not None))
                 else:
-                    await event.message.edit_text(self.reply_messages.no_games_yet())
+                    await edit_message(event.message, self.reply_messages.no_games_yet())
 
 
 class GameHistMenuHandler(BaseHandler):
     async def handle(self, event: aiogram.types.CallbackQuery):
         # we go from last(-1) to first(-len(v)-1) elements in inverse order
-        idx = int(event.data.split(".")[1])
+        idx = int(self.args[0])
         # check that element with idx exists
         if idx > -1 or idx < -len(self.user.game_history) - 1 or -idx > len(self.user.game_history):
             return
-        await event.message.edit_text(self.reply_messages.game_history(
-            g=self.user.game_history[idx],
-            field=keyboard_generator.render_final_field(self.user.game_history[idx])))
         keyboard = keyboard_generator.RenderGameHistoryMenu()
-        await event.message.edit_reply_markup(keyboard(self.keyboard_buttons, prev=idx-1, nxt=idx+1))
+        await edit_message(event.message, self.reply_messages.game_history(
+            g=self.user.game_history[idx],
+            field=keyboard_generator.render_final_field(self.user.game_history[idx])),
+            keyboard(self.keyboard_buttons, prev=idx-1, nxt=idx+1, idx=idx,
+                     replay=self.user.game_history[idx].seed is not None))
+
+
+class GameReplayHandler(BaseHandler):
+    async def handle(self, event: aiogram.types.CallbackQuery):
+        """
+        callback data: replay.{index of the game in history}.{number of moves to show}
+        """
+        try:
+            idx, step = map(int, self.args)
+        except ValueError:
+            return
+        if idx > -1 or -idx > len(self.user.game_history):
+            return
+        record = self.user.game_history[idx]
+        if record.seed is None or not 0 <= step <= record.move_count:
+            return
+        g = record.replay(step)
+        field = keyboard_generator.render_final_field(saper_game.GameRecord.from_game(g))
+        keyboard = keyboard_generator.RenderGameReplayMenu()
+        await edit_message(event.message, self.reply_messages.game_replay(step, record.move_count, g.score, field),
+                           keyboard(self.keyboard_buttons, idx=idx, step=step))
 
 
 class PlayHandler(BaseHandler):
     async def handle(self, event: aiogram.types.Message | aiogram.types.CallbackQuery):
         if isinstance(event, aiogram.types.Message):
-            g = saper_game.create_game()
+            g = await boards.get(1)
         elif isinstance(event, aiogram.types.CallbackQuery):
-            g = saper_game.create_game(int(event.data.split(".")[1]))
+            try:
+                g = await boards.get(int(self.args[0]))
+            except (ValueError, IndexError):
+                # not a mode of the pool, e.g. forged callback data
+                return
         else:
             raise TypeError("Event should be either Message, or CallbackQuery")
-        user_to_game[event.from_user.id] = g
-        logging.log(msg=f"player: {event.from_user.id}; game: {g}", level=logging.INFO)
+        logging.info("player: %s; game: %r", event.from_user.id, g)
         keyboard = keyboard_generator.RenderInlineGameKeyboard()(self.keyboard_buttons, g)
+        # after rendering, so the storage measures the game together with its cached keyboard
+        await user_to_game.store(event.from_user.id, g)
         if isinstance(event, aiogram.types.Message):
-            await event.answer(self.reply_messages.play(g), reply_markup=keyboard)
+            with telegram_latency.time(method="sendMessage"):
+                await event.answer(self.reply_messages.play(g), reply_markup=keyboard)
         elif isinstance(event, aiogram.types.CallbackQuery):
-            await event.message.edit_text(self.reply_messages.play(g))
-            await event.message.edit_reply_markup(keyboard)
+            await edit_message(event.message, self.reply_messages.play(g), keyboard)
 
 
 class GameCallBackHandler(BaseHandler):
     async def handle(self, callback_query: aiogram.types.CallbackQuery):
-        g = user_to_game[callback_query.from_user.id]
+        g = await user_to_game.load(callback_query.from_user.id)
         if g is None:
             return
         try:
-            x, y = map(int, callback_query.data.split(".")[1:])
-        except TypeError:
-            await callback_query.answer("Unable to process")
+            game_id, x, y = callback_codec.decode_cell(self.args)
+            if game_id != g.game_id:
+                # button of another game of the player, e.g. a tap on an old message
+                return
+            event = g.reveal_coordinate(x, y)
+        except ValueError:
+            with telegram_latency.time(method="answerCallbackQuery"):
+                await callback_query.answer("Unable to process")
+            return
+        if event.status_code == 3:
+            # the game did not change, a popup is enough
+            with telegram_latency.time(method="answerCallbackQuery"):
+                await callback_query.answer(self.reply_messages.event(g, event))
             return
-        event = g.reveal_coordinate(x, y)
         if event.game_over:
-            final_field = keyboard_generator.render_final_field(user_to_game[self.user.tg_user.id])
-            await callback_query.message.edit_text(
-                self.reply_messages.play_result(user_to_game[self.user.tg_user.id], event, final_field)
-            )
+            record = saper_game.GameRecord.from_game(g)
+            final_field = keyboard_generator.render_final_field(record)
+            keyboard = keyboard_generator.RenderInitialMenu()
+            await edit_message(callback_query.message, self.reply_messages.play_result(g, event, final_field),
+                               keyboard(self.keyboard_buttons))
             self.user.max_score = max(self.user.max_score, g.score)
             self.user.games_played += 1
-            self.user.game_history.append(g)
+            self.user.game_history.append(record)
             if event.status_code == 1:
                 self.user.winned_games += 1
-            user_to_game[callback_query.from_user.id] = None
-            keyboard = keyboard_generator.RenderInitialMenu()
-            await callback_query.message.edit_reply_markup(keyboard(self.keyboard_buttons))
+            await users.store(callback_query.from_user.id, self.user)
+            await leaderboard.record(callback_query.from_user.id, self.user.max_score)
+            await user_to_game.remove(callback_query.from_user.id)
             return
-        user_to_game[callback_query.from_user.id] = g
-        logging.log(msg=f"player: {callback_query.from_user.id}; game: {g}; event: {event}", level=logging.INFO)
-        keyboard = keyboard_generator.RenderInlineGameKeyboard()(self.keyboard_buttons, g)
-        await callback_query.message.edit_text(self.reply_messages.play(g, event))
-        await callback_query.message.edit_reply_markup(keyboard)
+        moves_logger.info("player: %s; game: %r; event: %r", callback_query.from_user.id, g, event)
+        keyboard = keyboard_generator.RenderInlineGameKeyboard()(self.keyboard_buttons, g, event)
+        await user_to_game.store(callback_query.from_user.id, g)
+        await edit_message(callback_query.message, self.reply_messages.play(g, event), keyboard)
 
 
-def setup_handlers(dp: aiogram.Dispatcher):
-    dp.register_message_handler(StartMessageHandler(), commands=['start'])
-    dp.register_callback_query_handler(StartMessageInlineHandler(), lambda x: x.data.lower() == "main_menu")
-
-    dp.register_callback_query_handler(MainMenuHandler(), lambda x: x.data.lower().startswith("main"))
+class CallbackRouter:
+    """
+    The only callback query handler of the dispatcher. Callback data is parsed once
+    and the update goes to the handler registered for its prefix, unknown prefixes are ignored.
+    """
 
-    dp.register_callback_query_handler(ProfileMenuHandler(), lambda x: x.data.lower().startswith("profile"))
+    def __init__(self):
+        self.routes: typing.Dict[str, BaseHandler] = {}
 
-    dp.register_callback_query_handler(LanguageMenuHandler(), lambda x: x.data.lower().startswith("language"))
+    def register(self, prefix: str, handler: BaseHandler):
+        self.routes[prefix] = handler
 
-    dp.register_callback_query_handler(StatisticsMenuHandler(), lambda x: x.data.lower().startswith("statistics"))
+    async def __call__(self, callback_query: aiogram.types.CallbackQuery):
+        callback = ParsedCallback.parse(callback_query.data)
+        handler = self.routes.get(callback.prefix)
+        if handler is not None:
+            await handler(callback_query, callback)
 
-    dp.register_callback_query_handler(GameHistMenuHandler(), lambda x: x.data.lower().startswith("hist"))
 
+def setup_handlers(dp: aiogram.Dispatcher):
+    dp.register_message_handler(StartMessageHandler(), commands=['start'])
     dp.register_message_handler(PlayHandler(), commands=['play'])
-    dp.register_callback_query_handler(PlayHandler(), lambda x: x.data.lower().startswith("play"))
 
-    dp.register_callback_query_handler(GameCallBackHandler(), lambda x: x.data.startswith("g"))
+    router = CallbackRouter()
+    router.register(callback_codec.GAME_PREFIX, GameCallBackHandler())
+    router.register("main_menu", StartMessageInlineHandler())
+    router.register("main", MainMenuHandler())
+    router.register("profile", ProfileMenuHandler())
+    router.register("language", LanguageMenuHandler())
+    router.register("statistics", StatisticsMenuHandler())
+    router.register("hist", GameHistMenuHandler())
+    router.register("replay", GameReplayHandler())
+    router.register("play", PlayHandler())
+    dp.register_callback_query_handler(router)
@@ -1,8 +1,11 @@
 import abc
+import sys
+import typing
+import weakref
 
 import aiogram.types.inline_keyboard
 
-from bot import button_texts
+from bot import button_texts, callback_codec, locales
 from bot.game import saper_game
 grid_to_emoji = {
     "*": "❔",
@@ -20,12 +23,13 @@ grid_to_emoji = {
 }
 
 
-def render_final_field(g: saper_game.Game):
+def render_final_field(record: saper_game.GameRecord):
     field = ""
-    for row in range(g.config.rows):
+    for row in range(record.rows):
         one_row = []
-        for col in range(g.config.cols):
-            text_value = grid_to_emoji.get(g.public_grid[row][col], g.public_grid[row][col])
+        for col in range(record.cols):
+            cell = record.cell(row, col)
+            text_value = grid_to_emoji.get(cell, cell)
             one_row.append(text_value)
         field += "".join(one_row)
         field += "\n"
@@ -33,34 +37,75 @@ def render_final_field(g: saper_game.Game):
 
 
 class RenderBaseKeyboard(abc.ABC):
+    # keyboards depending only on the language are rendered once per language and shared
+    static = False
+    _static_keyboards: typing.Dict[typing.Tuple[type, button_texts.BaseKeyboardButtonsTexts],
+                                   aiogram.types.inline_keyboard.InlineKeyboardMarkup] = {}
+
     def __call__(self, keyboard_button_text: button_texts.BaseKeyboardButtonsTexts, *args, **kwargs):
         self.keyboard_button_text = keyboard_button_text
-        return self.render(*args, **kwargs)
+        if not self.static:
+            return self.render(*args, **kwargs)
+        key = (type(self), keyboard_button_text)
+        keyboard = self._static_keyboards.get(key)
+        if keyboard is None:
+            keyboard = self._static_keyboards[key] = self.render(*args, **kwargs)
+        return keyboard
 
     @abc.abstractmethod
     def render(self, *args, **kwargs) -> aiogram.types.inline_keyboard.InlineKeyboardMarkup:
         raise NotImplemented
 
 
+# keyboards of running games, patched on every move instead of being rebuilt
+_game_keyboards: "weakref.WeakKeyDictionary[saper_game.Game, aiogram.types.inline_keyboard.InlineKeyboardMarkup]" = \
+    weakref.WeakKeyDictionary()
+
+
+# measured memory of one button of a game keyboard
+_GAME_BUTTON_BYTES = 512
+
+
+def game_memory_size(g: saper_game.Game) -> int:
+    """
+    Estimated memory of a running game together with its cached keyboard, which is much bigger than the game
+    """
+    if g is None:
+        return 0
+    keyboard = _GAME_BUTTON_BYTES * g.config.rows * g.config.cols if g in _game_keyboards else 0
+    return sys.getsizeof(g) + keyboard
+
+
 class RenderInlineGameKeyboard(RenderBaseKeyboard):
     def render(self, *args, **kwargs) -> aiogram.types.inline_keyboard.InlineKeyboardMarkup:
         """
         Important: g: saper_game.Game - mandatory param
+        event: saper_game.Event - optional, only cells from event.opened_coordinates are updated
+        in the keyboard rendered for the game before
         """
         g: saper_game.Game = args[0] if len(args) > 0 else kwargs["g"]
+        event: typing.Optional[saper_game.Event] = args[1] if len(args) > 1 else kwargs.get("event")
+        keyboard = _game_keyboards.get(g)
+        if keyboard is not None and event is not None:
+            for row, col in event.opened_coordinates:
+                keyboard.inline_keyboard[row][col].text = grid_to_emoji[g.public_cell(row, col)]
+            return keyboard
         keyboard = aiogram.types.inline_keyboard.InlineKeyboardMarkup(row_width=g.config.rows)
         for row in range(g.config.rows):
             one_row = []
             for col in range(g.config.cols):
-                text_value = grid_to_emoji.get(g.public_grid[row][col], g.public_grid[row][col])
-                button = aiogram.types.inline_keyboard.InlineKeyboardButton(text=text_value,
-                                                                            callback_data=f"g.{row}.{col}")
+                text_value = grid_to_emoji[g.public_cell(row, col)]
+                button = aiogram.types.inline_keyboard.InlineKeyboardButton(
+                    text=text_value, callback_data=callback_codec.encode_cell(g.game_id, row, col))
                 one_row.append(button)
             keyboard.row(*one_row)
+        _game_keyboards[g] = keyboard
         return keyboard
 
 
 class RenderInitialMenu(RenderBaseKeyboard):
+    static = True
+
     def render(self, *args, **kwargs) -> aiogram.types.inline_keyboard.InlineKeyboardMarkup:
         keyboard = aiogram.types.inline_keyboard.InlineKeyboardMarkup(3)
         texts = self.keyboard_button_text.main_menu()
@@ -75,6 +120,8 @@ class RenderInitialMenu(RenderBaseKeyboard):
 
 
 class RenderPlayMenu(RenderBaseKeyboard):
+    static = True
+
     def render(self, *args, **kwargs) -> aiogram.types.inline_keyboard.InlineKeyboardMarkup:
         keyboard = aiogram.types.inline_keyboard.InlineKeyboardMarkup(3)
         texts = self.keyboard_button_text.play()
@@ -87,6 +134,8 @@ class RenderPlayMenu(RenderBaseKeyboard):
 
 
 class RenderProfileMenu(RenderBaseKeyboard):
+    static = True
+
     def render(self, *args, **kwargs) -> aiogram.types.inline_keyboard.InlineKeyboardMarkup:
         keyboard = aiogram.types.inline_keyboard.InlineKeyboardMarkup(3)
         texts = self.keyboard_button_text.profile()
@@ -98,16 +147,19 @@ class RenderProfileMenu(RenderBaseKeyboard):
 
 
 class RenderLanguageMenu(RenderBaseKeyboard):
+    static = True
+
     def render(self, *args, **kwargs) -> aiogram.types.inline_keyboard.InlineKeyboardMarkup:
         keyboard = aiogram.types.inline_keyboard.InlineKeyboardMarkup(3)
         texts = self.keyboard_button_text.language()
-        english = aiogram.types.inline_keyboard.InlineKeyboardButton(text=texts[0], callback_data=f"language.en")
-        russian = aiogram.types.inline_keyboard.InlineKeyboardButton(text=texts[1], callback_data=f"language.ru")
-        keyboard.add(english, russian)
+        keyboard.add(*(aiogram.types.inline_keyboard.InlineKeyboardButton(text=text, callback_data=f"language.{code}")
+                       for code, text in zip(locales.catalogs(), texts)))
         return keyboard
 
 
 class RenderStatisticsMenu(RenderBaseKeyboard):
+    static = True
+
     def render(self, *args, **kwargs) -> aiogram.types.inline_keyboard.InlineKeyboardMarkup:
         keyboard = aiogram.types.inline_keyboard.InlineKeyboardMarkup(3)
         texts = self.keyboard_button_text.statistics()
@@ -120,8 +172,12 @@ class RenderStatisticsMenu(RenderBaseKeyboard):
 
 class RenderGameHistoryMenu(RenderBaseKeyboard):
     def render(self, *args, **kwargs) -> aiogram.types.inline_keyboard.InlineKeyboardMarkup:
+        """
+        idx: int - index of the shown game, replay: bool - add the button replaying it
+        """
         prev: int = args[0] if len(args) > 0 else kwargs.get("prev")
         nxt: int = args[0] if len(args) > 0 else kwargs.get("nxt")
+        idx: int = kwargs.get("idx", -1)
         keyboard = aiogram.types.inline_keyboard.InlineKeyboardMarkup(3)
         texts = self.keyboard_button_text.game_history()
         # Callback data shows inverse indexing, we go from last(-1) to first(-len(v)-1) elements
@@ -135,11 +191,33 @@ class RenderGameHistoryMenu(RenderBaseKeyboard):
         )
         main_menu = aiogram.types.inline_keyboard.InlineKeyboardButton(text=texts[-1], callback_data="main_menu")
         keyboard.add(prv, nxt)
+        if kwargs.get("replay"):
+            replay = aiogram.types.inline_keyboard.InlineKeyboardButton(text=texts[2], callback_data=f"replay.{idx}.0")
+            keyboard.add(replay)
         keyboard.add(main_menu)
         return keyboard
 
 
+class RenderGameReplayMenu(RenderBaseKeyboard):
+    def render(self, *args, **kwargs) -> aiogram.types.inline_keyboard.InlineKeyboardMarkup:
+        """
+        idx: int - index of the game in history, step: int - number of shown moves
+        """
+        idx: int = kwargs["idx"]
+        step: int = kwargs["step"]
+        keyboard = aiogram.types.inline_keyboard.InlineKeyboardMarkup(3)
+        texts = self.keyboard_button_text.game_replay()
+        prv = aiogram.types.inline_keyboard.InlineKeyboardButton(text=texts[0], callback_data=f"replay.{idx}.{step - 1}")
+        nxt = aiogram.types.inline_keyboard.InlineKeyboardButton(text=texts[1], callback_data=f"replay.{idx}.{step + 1}")
+        back = aiogram.types.inline_keyboard.InlineKeyboardButton(text=texts[-1], callback_data=f"hist.{idx}")
+        keyboard.add(prv, nxt)
+        keyboard.add(back)
+        return keyboard
+
+
 class RenderLeaderBoardMenu(RenderBaseKeyboard):
+    static = True
+
     def render(self, *args, **kwargs) -> aiogram.types.inline_keyboard.InlineKeyboardMarkup:
         keyboard = aiogram.types.inline_keyboard.InlineKeyboardMarkup(3)
         texts = self.keyboard_button_text.leaderboard()
@@ -0,0 +1,26 @@
+"""
+Texts of every language are kept in <language code>.json next to this file,
+a language is added by adding its catalog with the same keys as en.json,
+its language_name is shown in the language menu of every language.
+"""
+import functools
+import json
+import os
+import typing
+
+DEFAULT_LANGUAGE = "en"
+CATALOG_DIR = os.path.dirname(__file__)
+
+
+@functools.lru_cache(maxsize=None)
+def catalogs() -> typing.Dict[str, typing.Dict]:
+    """
+    Catalogs by language code, files are read once
+    """
+    result = {}
+    for file_name in sorted(os.listdir(CATALOG_DIR)):
+        code, extension = os.path.splitext(file_name)
+        if extension == ".json":
+            with open(os.path.join(CATALOG_DIR, file_name), encoding="utf-8") as f:
+                result[code] = json.load(f)
+    return result
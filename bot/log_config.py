@@ -0,0 +1,70 @@
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+
+# per-move events go to this logger, only a sample of them is written
+MOVES_LOGGER = "bot.moves"
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes a random share of records, the rest is dropped before their message is formatted
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return self.rate >= 1 or random.random() < self.rate
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records to the queue with only msg % args merged, the exception traceback is formatted
+    by the listener thread like the rest of the record
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+
+def setup_logging(path: str = "logs.log", level: int = logging.INFO, max_bytes: int = 10 * 1024 * 1024,
+                  backup_count: int = 5, moves_sample_rate: float = 0.1) -> logging.handlers.QueueListener:
+    """
+    Log records are put to a queue by the event loop thread and written to a size-rotated file
+    by a background thread. The returned listener must be stopped on shutdown to flush the queue.
+    """
+    file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                        encoding="utf-8")
+    file_handler.setFormatter(JsonFormatter())
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers = [QueueHandler(log_queue)]
+    logging.getLogger(MOVES_LOGGER).addFilter(SamplingFilter(moves_sample_rate))
+    listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    return listener
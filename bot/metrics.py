@@ -0,0 +1,170 @@
+import abc
+import asyncio
+import bisect
+import collections
+import contextlib
+import math
+import time
+import typing
+
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Labels = typing.Tuple[str, ...]
+
+
+class Metric(abc.ABC):
+    """
+    Metric in Prometheus text exposition format, registered in REGISTRY on creation
+    """
+    type: str
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def _key(self, labels: typing.Dict[str, str]) -> Labels:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, key: Labels, extra: typing.Sequence[typing.Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    @abc.abstractmethod
+    def samples(self) -> typing.Iterator[str]:
+        raise NotImplemented
+
+    async def collect(self):
+        """
+        Called before every scrape, metrics whose values have to be awaited read them here
+        """
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}",
+                          *self.samples()])
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: typing.DefaultDict[Labels, float] = collections.defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels: str):
+        self._values[self._key(labels)] += amount
+
+    def samples(self) -> typing.Iterator[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{self._format_labels(key)} {_format_value(value)}"
+
+
+class Gauge(Metric):
+    """
+    Value is either set by the code or read from function on every scrape.
+    function may be a coroutine function (e.g. one asking a server), it is awaited by collect
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = (),
+                 function: typing.Optional[typing.Callable[[], typing.Union[float, typing.Awaitable[float]]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+        self._values: typing.DefaultDict[Labels, float] = collections.defaultdict(float)
+
+    def set(self, value: float, **labels: str):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str):
+        self._values[self._key(labels)] += amount
+
+    def dec(self, amount: float = 1, **labels: str):
+        self._values[self._key(labels)] -= amount
+
+    async def collect(self):
+        if asyncio.iscoroutinefunction(self.function):
+            self.set(await self.function())
+
+    def samples(self) -> typing.Iterator[str]:
+        if self.function is not None and not asyncio.iscoroutinefunction(self.function):
+            yield f"{self.name} {_format_value(self.function())}"
+            return
+        for key, value in self._values.items():
+            yield f"{self.name}{self._format_labels(key)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = (),
+                 buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._counts: typing.Dict[Labels, typing.List[int]] = {}
+        self._sums: typing.DefaultDict[Labels, float] = collections.defaultdict(float)
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> typing.Iterator[str]:
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{self._format_labels(key, [('le', _format_value(bound))])} {cumulative}"
+            yield f"{self.name}_sum{self._format_labels(key)} {_format_value(self._sums[key])}"
+            yield f"{self.name}_count{self._format_labels(key)} {cumulative}"
+
+
+REGISTRY: typing.List[Metric] = []
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+async def collect():
+    for metric in REGISTRY:
+        await metric.collect()
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    await collect()
+    return web.Response(text=render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def start_server(host: str, port: int) -> web.AppRunner:
+    """
+    Serves all registered metrics on http://host:port/metrics
+    """
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,665 @@
+import abc
+import asyncio
+import collections.abc
+import contextlib
+import functools
+import itertools
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import typing
+import uuid
+
+import dill
+
+from bot import additional_classes, metrics
+
+_MISSING = object()
+
+flush_latency = metrics.Histogram("bot_storage_flush_seconds", "Time spent writing changed keys", ["table"])
+cache_events = metrics.Counter("bot_storage_cache_events_total",
+                               "Values dropped from the memory cache (evicted) and read back from disk (loaded)",
+                               ["table", "event"])
+cache_bytes = metrics.Gauge("bot_storage_cache_bytes", "Estimated size of cached values with a memory budget",
+                            ["table"])
+
+
+class AsyncMapping(collections.abc.MutableMapping):
+    """
+    Mapping whose values handlers read and write with coroutines, so a backend talking to a server
+    does not block the event loop. The default coroutines call the synchronous methods,
+    which is right for values kept in memory or in local files.
+    """
+
+    async def load(self, key: int, default=None):
+        return self.get(key, default)
+
+    async def load_many(self, keys: typing.Iterable[int]) -> typing.List[typing.Any]:
+        """
+        Values of keys in the same order, None for missing keys
+        """
+        return [self.get(key) for key in keys]
+
+    async def store(self, key: int, value):
+        self[key] = value
+
+    async def remove(self, key: int):
+        """
+        Deletes the key if it exists
+        """
+        self.pop(key, None)
+
+    async def size(self) -> int:
+        return len(self)
+
+
+class MemoryStorage(dict, AsyncMapping):
+    """
+    Mapping kept in memory only, used until load_context replaces it with the backend's mappings
+    """
+
+
+class StateBackend(abc.ABC):
+    """
+    Place where users, games and scores live. Every worker serving the bot must use the same backend.
+    locks - per-user lock, updates of a user are processed under it, so read-modify-write of
+    the user's records is atomic for all workers sharing the backend.
+    """
+
+    locks: additional_classes.KeyedLock
+
+    @abc.abstractmethod
+    def mapping(self, name: str, **cache_options) -> AsyncMapping:
+        """
+        cache_options tune the memory cache of the mapping, backends without one ignore them
+        """
+        raise NotImplemented
+
+    @abc.abstractmethod
+    def leaderboard(self, name: str = "scores"):
+        raise NotImplemented
+
+    @abc.abstractmethod
+    async def close(self):
+        raise NotImplemented
+
+    def start_checkpoints(self, interval: float, dirty_threshold: int):
+        """
+        Must be called from the running event loop. Backends writing every change right away have nothing to do
+        """
+
+
+class SqliteBackend(StateBackend):
+    """
+    Local files, one sqlite database per mapping. Serves a single worker process.
+    """
+
+    def __init__(self, data_dir: str = "."):
+        self.data_dir = data_dir
+        self.locks = additional_classes.KeyedLock()
+        self._storages: typing.List[SqliteStorage] = []
+        self._checkpointer: typing.Optional[Checkpointer] = None
+
+    def mapping(self, name: str, **cache_options) -> "SqliteStorage":
+        return self._add(SqliteStorage(os.path.join(self.data_dir, f"{name}.sqlite3"), name, **cache_options))
+
+    def _add(self, mapping: "SqliteStorage") -> "SqliteStorage":
+        mapping.checkpointer = self._checkpointer
+        self._storages.append(mapping)
+        return mapping
+
+    def start_checkpoints(self, interval: float, dirty_threshold: int):
+        self._checkpointer = Checkpointer(self._storages, interval, dirty_threshold)
+        self._checkpointer.start()
+
+    def leaderboard(self, name: str = "scores") -> additional_classes.Leaderboard:
+        # scores are plain integers, so the index is rebuilt on start without deserializing every row
+        return additional_classes.Leaderboard(self._add(IntegerStorage(os.path.join(self.data_dir, f"{name}.sqlite3"),
+                                                                       name)))
+
+    async def close(self):
+        if self._checkpointer is not None:
+            self._checkpointer.close()
+            self._checkpointer = None
+        for mapping in self._storages:
+            mapping.close()
+
+
+class RedisBackend(StateBackend):
+    """
+    Redis (or any server speaking its protocol) shared by several worker processes.
+    Needs the redis package, which is not a dependency of the bot. Handlers and metrics talk to the server
+    through async_client, the blocking client is only used on start and by synchronous mapping methods.
+    Ready clients of the same server (e.g. fakeredis) can be passed instead of url.
+    """
+
+    def __init__(self, url: typing.Optional[str] = None, client=None, async_client=None,
+                 prefix: str = "minesweeper"):
+        if client is None or async_client is None:
+            try:
+                import redis
+                import redis.asyncio
+            except ImportError as e:
+                raise ImportError("redis package is required for RedisBackend: pip install redis") from e
+            client = redis.Redis.from_url(url)
+            async_client = redis.asyncio.Redis.from_url(url)
+        self.client = client
+        self.async_client = async_client
+        self.prefix = prefix
+        self.locks = RedisKeyedLock(async_client, f"{prefix}:lock")
+
+    def mapping(self, name: str, **cache_options) -> "RedisStorage":
+        return RedisStorage(self.client, self.async_client, f"{self.prefix}:{name}")
+
+    def leaderboard(self, name: str = "scores") -> "RedisLeaderboard":
+        return RedisLeaderboard(self.client, self.async_client, f"{self.prefix}:{name}")
+
+    async def close(self):
+        self.client.close()
+        await self.async_client.aclose()
+
+
+class SqliteStorage(AsyncMapping):
+    """
+    Persistent mapping of telegram user id to an arbitrary object.
+
+    Every key is stored as a separate row, so a write costs O(changed keys) instead of
+    dumping the whole dict. Nothing is read on start: values are deserialized on first access
+    and at most cache_size of the most recently used ones are kept in memory. Values mutated
+    in place must be assigned back (storage[key] = value) to be written.
+    memory_budget limits the total sizeof() of cached values in bytes, idle_ttl drops values
+    not used for that many seconds. Dropped values are loaded again on the next access.
+    Changed values are written every flush_interval seconds on the next change, or by checkpointer
+    if one is attached: values are still dumped on the event loop, the database is written by a worker thread.
+    len() and iteration combine the written rows with the changes waiting for a write, they never flush.
+    """
+
+    # type of the value column, values are converted to it by _dumps and back by _loads
+    value_type = "BLOB"
+    _dumps = staticmethod(dill.dumps)
+    _loads = staticmethod(dill.loads)
+
+    def __init__(self, path: str, table: str, flush_interval: float = 5.0, compact_interval: float = 60.0,
+                 cache_size: int = 10000, memory_budget: typing.Optional[int] = None,
+                 idle_ttl: typing.Optional[float] = None, sizeof: typing.Callable[[typing.Any], int] = sys.getsizeof):
+        self.path = path
+        self.table = table
+        self.flush_interval = flush_interval
+        self.compact_interval = compact_interval
+        self.cache_size = cache_size
+        self.memory_budget = memory_budget
+        self.idle_ttl = idle_ttl
+        self.sizeof = sizeof
+        # evictions and loads of the memory cache
+        self.stats: typing.Counter[str] = collections.Counter()
+        self.checkpointer: typing.Optional[Checkpointer] = None
+        # writes come from the event loop or a checkpoint thread, one at a time under _write_lock
+        self._writer = sqlite3.connect(path, check_same_thread=False)
+        # pages of deleted rows are released by compact() without rewriting the file, only new files can enable it
+        self._writer.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._writer.execute(f"CREATE TABLE IF NOT EXISTS {table} (key INTEGER PRIMARY KEY, "
+                             f"value {self.value_type} NOT NULL)")
+        self._writer.commit()
+        self._write_lock = threading.Lock()
+        # reads, on the event loop only
+        self._connection = sqlite3.connect(path)
+        self._count = self._connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        # least recently used first
+        self._cache: typing.OrderedDict[int, typing.Any] = collections.OrderedDict()
+        self._used_at: typing.Dict[int, float] = {}
+        self._sizes: typing.Dict[int, int] = {}
+        self._cache_bytes = 0
+        # cached values changed since the last snapshot
+        self._dirty: typing.Set[int] = set()
+        # dumps of changed values waiting to be written, None for deleted keys
+        self._pending: typing.Dict[int, typing.Optional[bytes]] = {}
+        self._last_flush = time.monotonic()
+        self._last_compaction = time.monotonic()
+
+    def __getitem__(self, key: int):
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self._used_at[key] = time.monotonic()
+            self._evict()
+            return self._cache[key]
+        if key in self._pending:
+            dump = self._pending[key]
+        else:
+            row = self._connection.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            dump = row and row[0]
+        if dump is None:
+            raise KeyError(key)
+        value = self._loads(dump)
+        self.stats["loads"] += 1
+        cache_events.inc(table=self.table, event="loaded")
+        self._cache_value(key, value)
+        return value
+
+    def __setitem__(self, key: int, value):
+        if key not in self:
+            self._count += 1
+        self._dirty.add(key)
+        self._cache_value(key, value)
+        self._maybe_flush()
+
+    def __delitem__(self, key: int):
+        if key not in self:
+            raise KeyError(key)
+        self._forget(key)
+        self._dirty.discard(key)
+        self._pending[key] = None
+        self._count -= 1
+        self._maybe_flush()
+
+    def __contains__(self, key) -> bool:
+        if key in self._cache:
+            return True
+        if key in self._pending:
+            return self._pending[key] is not None
+        return self._connection.execute(f"SELECT 1 FROM {self.table} WHERE key = ?", (key,)).fetchone() is not None
+
+    def __iter__(self) -> typing.Iterator[int]:
+        keys = {row[0] for row in self._connection.execute(f"SELECT key FROM {self.table}")}
+        keys.difference_update(key for key, dump in self._pending.items() if dump is None)
+        keys.update(key for key, dump in self._pending.items() if dump is not None)
+        # a cached key exists even if its deletion is still waiting for a write
+        keys.update(self._cache)
+        return iter(keys)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def items(self) -> collections.abc.ItemsView:
+        return _ItemsView(self)
+
+    def _scan(self) -> typing.Iterator[typing.Tuple[int, typing.Any]]:
+        # values not written yet, None for deleted keys
+        changed = dict(self._pending)
+        changed.update(self._cache)
+        for key, value in self._connection.execute(f"SELECT key, value FROM {self.table}"):
+            if key not in changed:
+                yield key, self._loads(value)
+        for key, value in changed.items():
+            if key in self._cache:
+                yield key, value
+            elif value is not None:
+                yield key, self._loads(value)
+
+    def _cache_value(self, key: int, value):
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        self._used_at[key] = time.monotonic()
+        if self.memory_budget is not None:
+            size = self.sizeof(value)
+            self._cache_bytes += size - self._sizes.get(key, 0)
+            self._sizes[key] = size
+            cache_bytes.set(self._cache_bytes, table=self.table)
+        self._evict()
+
+    def _forget(self, key: int):
+        if key not in self._cache:
+            return
+        del self._cache[key]
+        del self._used_at[key]
+        if self.memory_budget is not None:
+            self._cache_bytes -= self._sizes.pop(key)
+            cache_bytes.set(self._cache_bytes, table=self.table)
+
+    def _evict(self):
+        """
+        Drops least recently used values while the cache is over one of its limits
+        """
+        now = time.monotonic()
+        while self._cache:
+            key = next(iter(self._cache))
+            if not (len(self._cache) > self.cache_size
+                    or self.memory_budget is not None and self._cache_bytes > self.memory_budget
+                    or self.idle_ttl is not None and now - self._used_at[key] > self.idle_ttl):
+                return
+            if key in self._dirty:
+                self._pending[key] = self._dumps(self._cache[key])
+                self._dirty.discard(key)
+            self._forget(key)
+            self.stats["evictions"] += 1
+            cache_events.inc(table=self.table, event="evicted")
+
+    def _maybe_flush(self):
+        if self.checkpointer is not None:
+            if len(self._dirty) + len(self._pending) >= self.checkpointer.dirty_threshold:
+                self.checkpointer.wakeup()
+        elif time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _snapshot(self, max_dumps: typing.Optional[int] = None) \
+            -> typing.Tuple[typing.Dict[int, typing.Optional[bytes]], bool]:
+        """
+        Dumps up to max_dumps values changed since the last snapshot, so they can be written while the cached
+        objects change. Returns the keys to write and whether to compact after writing them
+        """
+        self._last_flush = time.monotonic()
+        keys = list(self._dirty) if max_dumps is None else list(itertools.islice(self._dirty, max_dumps))
+        for key in keys:
+            self._pending[key] = self._dumps(self._cache[key])
+        self._dirty.difference_update(keys)
+        return dict(self._pending), time.monotonic() - self._last_compaction >= self.compact_interval
+
+    def _write(self, batch: typing.Dict[int, typing.Optional[bytes]], compact: bool) -> float:
+        """
+        Writes batch in a single transaction under _write_lock, returns the seconds it took
+        """
+        start = time.perf_counter()
+        with self._writer:
+            self._writer.executemany(f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)",
+                                     [(key, dump) for key, dump in batch.items() if dump is not None])
+            self._writer.executemany(f"DELETE FROM {self.table} WHERE key = ?",
+                                     [(key,) for key, dump in batch.items() if dump is None])
+        if compact:
+            self._compact()
+        return time.perf_counter() - start
+
+    def _write_and_release(self, batch: typing.Dict[int, typing.Optional[bytes]], compact: bool) -> float:
+        try:
+            return self._write(batch, compact)
+        finally:
+            self._write_lock.release()
+
+    def _written(self, batch: typing.Dict[int, typing.Optional[bytes]], compact: bool, seconds: float):
+        # keys changed again after the snapshot keep their newer dump
+        for key, dump in batch.items():
+            if self._pending.get(key, _MISSING) is dump:
+                del self._pending[key]
+        flush_latency.observe(seconds, table=self.table)
+        if compact:
+            self._last_compaction = time.monotonic()
+
+    def flush(self):
+        """
+        Writes every key changed since the last flush in a single transaction, after a running checkpoint
+        """
+        with self._write_lock:
+            batch, compact = self._snapshot()
+            if batch:
+                self._written(batch, compact, self._write(batch, compact))
+
+    @property
+    def dirty(self) -> int:
+        """
+        Changed keys not dumped yet
+        """
+        return len(self._dirty)
+
+    async def checkpoint(self, max_dumps: typing.Optional[int] = None):
+        """
+        Same as flush, but only up to max_dumps values are dumped on the event loop, they are written by a worker
+        thread. Does nothing while the previous write is running, its keys are written by the next checkpoint.
+        """
+        if not self._write_lock.acquire(blocking=False):
+            return
+        batch, compact = self._snapshot(max_dumps)
+        if not batch:
+            self._write_lock.release()
+            return
+        # the thread releases the lock, so flush() called on the event loop meanwhile waits for it without a deadlock
+        seconds = await asyncio.get_running_loop().run_in_executor(None, self._write_and_release, batch, compact)
+        self._written(batch, compact, seconds)
+
+    def _compact(self):
+        # PASSIVE does not wait for readers, the rest of the log is folded by a later compaction
+        self._writer.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+        # execute() steps the pragma once and frees a single page, executescript() runs it to the end
+        self._writer.executescript("PRAGMA incremental_vacuum")
+
+    def compact(self):
+        """
+        Folds the write-ahead log into the database file and releases free pages, runs every compact_interval seconds
+        with a write
+        """
+        with self._write_lock:
+            self._compact()
+        self._last_compaction = time.monotonic()
+
+    def vacuum(self):
+        """
+        Rewrites the whole database file, a maintenance step which is never run automatically.
+        Also enables incremental compaction of files created before it was supported
+        """
+        with self._write_lock:
+            self._writer.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self._writer.execute("VACUUM")
+
+    def close(self):
+        self.flush()
+        self.compact()
+        self._connection.close()
+        self._writer.close()
+
+
+class IntegerStorage(SqliteStorage):
+    """
+    SqliteStorage of int values kept in an INTEGER column, rows are read back as they are.
+    Values dumped by dill in files written by previous versions are converted on open
+    """
+
+    value_type = "INTEGER"
+    _dumps = staticmethod(int)
+    _loads = staticmethod(int)
+
+    def __init__(self, path: str, table: str, **options):
+        super().__init__(path, table, **options)
+        legacy = self._connection.execute(f"SELECT key, value FROM {table} WHERE typeof(value) = 'blob'").fetchall()
+        if legacy:
+            with self._writer:
+                self._writer.executemany(f"UPDATE {table} SET value = ? WHERE key = ?",
+                                         [(int(dill.loads(dump)), key) for key, dump in legacy])
+
+    def _scan(self) -> typing.Iterator[typing.Tuple[int, typing.Any]]:
+        if self._pending or self._cache:
+            return super()._scan()
+        # e.g. on start, the rows are all there is and need no conversion
+        return iter(self._connection.execute(f"SELECT key, value FROM {self.table}"))
+
+
+class Checkpointer:
+    """
+    Background task writing the changes of storages every interval seconds, and right away once a storage
+    has dirty_threshold changed keys. A crash loses at most the changes of the last interval or dirty_threshold keys.
+    A checkpoint dumps at most max_dumps values on the event loop, the rest are dumped by the following ones.
+    """
+
+    def __init__(self, storages: typing.List[SqliteStorage], interval: float = 5.0, dirty_threshold: int = 1000,
+                 max_dumps: int = 100):
+        self.storages = storages
+        self.interval = interval
+        self.dirty_threshold = dirty_threshold
+        self.max_dumps = max_dumps
+        for mapping in storages:
+            mapping.checkpointer = self
+        self._wakeup = asyncio.Event()
+        self._task: typing.Optional[asyncio.Task] = None
+
+    def wakeup(self):
+        self._wakeup.set()
+
+    def start(self):
+        """
+        Starts checkpoints in the running event loop
+        """
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def close(self):
+        """
+        Stops checkpoints, the storages flush changes on their own again
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for mapping in self.storages:
+            mapping.checkpointer = None
+
+    async def _run(self):
+        while True:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            self._wakeup.clear()
+            for mapping in self.storages:
+                try:
+                    await mapping.checkpoint(self.max_dumps)
+                except Exception:
+                    logging.exception("checkpoint of %s failed", mapping.table)
+                if mapping.dirty:
+                    self.wakeup()
+
+
+class _ItemsView(collections.abc.ItemsView):
+    """
+    Reads all rows with a single query instead of a lookup per key, read values are not cached
+    """
+
+    def __iter__(self):
+        return self._mapping._scan()
+
+
+class RedisStorage(AsyncMapping):
+    """
+    Mapping stored in a redis hash, values are dill dumps. Nothing is cached, so every worker
+    sees the latest value. Values mutated in place must be assigned back (await storage.store(key, value)) to be written.
+    The coroutines use async_client, the synchronous methods block on client and are meant for start and maintenance.
+    """
+
+    def __init__(self, client, async_client, name: str):
+        self.client = client
+        self.async_client = async_client
+        self.name = name
+
+    def __getitem__(self, key: int):
+        value = self.client.hget(self.name, key)
+        if value is None:
+            raise KeyError(key)
+        return dill.loads(value)
+
+    def __setitem__(self, key: int, value):
+        self.client.hset(self.name, key, dill.dumps(value))
+
+    def __delitem__(self, key: int):
+        if not self.client.hdel(self.name, key):
+            raise KeyError(key)
+
+    def __contains__(self, key) -> bool:
+        return bool(self.client.hexists(self.name, key))
+
+    def __iter__(self) -> typing.Iterator[int]:
+        return (int(key) for key, _ in self.client.hscan_iter(self.name))
+
+    def __len__(self) -> int:
+        return self.client.hlen(self.name)
+
+    def items(self) -> collections.abc.ItemsView:
+        return _ItemsView(self)
+
+    def _scan(self) -> typing.Iterator[typing.Tuple[int, typing.Any]]:
+        for key, value in self.client.hscan_iter(self.name):
+            yield int(key), dill.loads(value)
+
+    async def load(self, key: int, default=None):
+        value = await self.async_client.hget(self.name, key)
+        return default if value is None else dill.loads(value)
+
+    async def load_many(self, keys: typing.Iterable[int]) -> typing.List[typing.Any]:
+        keys = list(keys)
+        if not keys:
+            return []
+        return [None if value is None else dill.loads(value)
+                for value in await self.async_client.hmget(self.name, keys)]
+
+    async def store(self, key: int, value):
+        await self.async_client.hset(self.name, key, dill.dumps(value))
+
+    async def remove(self, key: int):
+        await self.async_client.hdel(self.name, key)
+
+    async def size(self) -> int:
+        return await self.async_client.hlen(self.name)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class RedisLeaderboard:
+    """
+    Leaderboard kept in a redis sorted set, shared by all workers. Same interface as additional_classes.Leaderboard
+    """
+
+    def __init__(self, client, async_client, name: str):
+        self.client = client
+        self.async_client = async_client
+        self.name = name
+
+    def __len__(self):
+        return self.client.zcard(self.name)
+
+    def update(self, user_id: int, score: int):
+        self.client.zadd(self.name, {user_id: score})
+
+    def rank(self, user_id: int) -> int:
+        score = self.client.zscore(self.name, user_id)
+        return self.client.zcount(self.name, f"({score}", "+inf") + 1
+
+    def top(self, n: int = 10) -> typing.List[int]:
+        return [int(user_id) for user_id in self.client.zrevrange(self.name, 0, n - 1)]
+
+    async def record(self, user_id: int, score: int):
+        await self.async_client.zadd(self.name, {user_id: score})
+
+    async def standings(self, user_id: int, n: int = 10) -> typing.Tuple[typing.List[int], int]:
+        async with self.async_client.pipeline(transaction=False) as pipe:
+            pipe.zrevrange(self.name, 0, n - 1)
+            pipe.zscore(self.name, user_id)
+            top, score = await pipe.execute()
+        rank = await self.async_client.zcount(self.name, f"({score}", "+inf") + 1
+        return [int(user_id) for user_id in top], rank
+
+
+class RedisKeyedLock(additional_classes.KeyedLock):
+    """
+    Per-key lock held across worker processes. Tasks of one worker queue on the local lock first,
+    then the worker takes the redis lock (SET NX with expiry, so a crashed worker does not block the key forever).
+    A lock held by another worker is polled with the interval doubling from poll_interval up to max_poll_interval.
+    """
+
+    def __init__(self, client, prefix: str, ttl: float = 30, poll_interval: float = 0.005,
+                 max_poll_interval: float = 0.1):
+        super().__init__()
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+
+    @contextlib.asynccontextmanager
+    async def __call__(self, key):
+        async with super().__call__(key):
+            name, token = f"{self.prefix}:{key}", uuid.uuid4().hex
+            interval = self.poll_interval
+            while not await self.client.set(name, token, nx=True, px=int(self.ttl * 1000)):
+                self.stats["remote_waits"] += 1
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, self.max_poll_interval)
+            try:
+                yield
+            finally:
+                await self.client.transaction(functools.partial(self._release, name=name, token=token), name)
+
+    @staticmethod
+    async def _release(pipe, name: str, token: str):
+        # the lock may have expired and been taken by another worker
+        if await pipe.get(name) == token.encode():
+            pipe.multi()
+            pipe.delete(name)
@@ -0,0 +1,168 @@
+import asyncio
+import collections
+import hmac
+import itertools
+import json
+import logging
+import secrets
+import tempfile
+import time
+import typing
+
+import aiogram
+import aiogram.dispatcher.webhook
+import aiohttp
+from aiohttp import web
+
+from bot import handlers, keyboard_generator
+
+# telegram sends the secret_token passed to set_webhook in this header of every update
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class LocalBot(aiogram.Bot):
+    """
+    Bot that answers Bot API requests locally instead of sending them to telegram.
+    Every request is recorded, so handlers can be exercised without network and a real token.
+    """
+
+    def __init__(self, record: bool = True):
+        super().__init__(token="123456789:LOCAL")
+        self.record = record
+        self.requests: typing.List[typing.Tuple[str, typing.Optional[typing.Dict]]] = []
+        # the last keyboard sent to every chat
+        self.keyboards: typing.Dict[int, typing.List[typing.List[typing.Dict]]] = {}
+        self._message_ids = itertools.count(1)
+
+    async def request(self, method: str, data: typing.Optional[typing.Dict] = None,
+                      files: typing.Optional[typing.Dict] = None, **kwargs):
+        if self.record:
+            self.requests.append((method, data))
+        if data and "chat_id" in data:
+            markup = data.get("reply_markup")
+            self.keyboards[int(data["chat_id"])] = json.loads(markup)["inline_keyboard"] if markup else []
+        if method == "sendMessage":
+            return {"message_id": next(self._message_ids), "date": int(time.time()), "text": data.get("text"),
+                    "chat": {"id": data.get("chat_id"), "type": "private"}}
+        return True
+
+    def closed_cells(self, chat_id: int) -> typing.List[str]:
+        """
+        Callback data of the closed cells in the last keyboard sent to the chat
+        """
+        closed = keyboard_generator.grid_to_emoji["*"]
+        return [button["callback_data"] for row in self.keyboards.get(chat_id, []) for button in row
+                if button["text"] == closed]
+
+
+def _secret_checker(secret_token: str):
+    @web.middleware
+    async def check_secret(request: web.Request, handler):
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, "").encode(), secret_token.encode()):
+            return web.Response(status=401)
+        return await handler(request)
+
+    return check_secret
+
+
+async def start_server(dp: aiogram.Dispatcher, host: str, port: int, path: str,
+                       secret_token: typing.Optional[str] = None) -> web.AppRunner:
+    """
+    Serves telegram updates posted to http://host:port/path with the dispatcher.
+    With secret_token requests without it in SECRET_HEADER are rejected with 401.
+    """
+    app = aiogram.dispatcher.webhook.get_new_configured_app(dp, path)
+    if secret_token:
+        app.middlewares.append(_secret_checker(secret_token))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def run_webhook(dp: aiogram.Dispatcher, host: str, port: int, path: str,
+                      webhook_url: typing.Optional[str] = None, secret_token: typing.Optional[str] = None):
+    """
+    Runs until cancelled. If webhook_url is passed, telegram is asked to deliver updates to it
+    together with secret_token, a random one is used if it is not set.
+    """
+    if webhook_url and not secret_token:
+        secret_token = secrets.token_urlsafe(32)
+    if not secret_token:
+        logging.warning("Webhook secret is not set, anyone who knows the path can post updates")
+    runner = await start_server(dp, host, port, path, secret_token)
+    logging.info("Webhook server is listening on %s:%s%s", host, port, path)
+    try:
+        if webhook_url:
+            await dp.bot.set_webhook(webhook_url, secret_token=secret_token)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def _user(user_id: int) -> typing.Dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"Player {user_id}", "language_code": "en"}
+
+
+def message_update(update_id: int, user_id: int, text: str) -> typing.Dict:
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "text": text, "from": _user(user_id),
+        "chat": {"id": user_id, "type": "private"},
+        "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}] if text.startswith("/") else [],
+    }}
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> typing.Dict:
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": _user(user_id), "chat_instance": str(user_id), "data": data,
+        "message": {"message_id": 1, "date": int(time.time()), "text": "", "chat": {"id": user_id, "type": "private"}},
+    }}
+
+
+def synthetic_start(user_id: int, update_ids: typing.Iterator[int]) -> typing.List[typing.Dict]:
+    """
+    Updates of a player who opens the menu and starts an easy game
+    """
+    return [message_update(next(update_ids), user_id, "/start"),
+            callback_update(next(update_ids), user_id, "main.play"),
+            callback_update(next(update_ids), user_id, "play.0")]
+
+
+async def self_test(host: str = "127.0.0.1", port: int = 0, path: str = "/webhook", players: int = 3) -> bool:
+    """
+    Starts the webhook server with a LocalBot and temporary storage, posts synthetic updates to it
+    and checks that every one was accepted and answered through the Bot API, and that a forged one is rejected
+    """
+    secret_token = secrets.token_urlsafe(32)
+    bot = LocalBot()
+    dp = aiogram.Dispatcher(bot)
+    with tempfile.TemporaryDirectory() as data_dir:
+        handlers.load_context(data_dir)
+        handlers.setup_handlers(dp)
+        runner = await start_server(dp, host, port, path, secret_token)
+        try:
+            url = "http://{}:{}{}".format(*runner.addresses[0][:2], path)
+            statuses = collections.Counter()
+            update_ids = itertools.count(1)
+            async with aiohttp.ClientSession() as session:
+                async def post(update: typing.Dict, signed: bool = True):
+                    headers = {SECRET_HEADER: secret_token} if signed else {}
+                    async with session.post(url, json=update, headers=headers) as response:
+                        statuses[response.status] += 1
+
+                # a forged update without the secret must not reach the handlers
+                await post(message_update(next(update_ids), 1, "/start"), signed=False)
+                for player in range(1, players + 1):
+                    for update in synthetic_start(player, update_ids):
+                        await post(update)
+                    # taps every closed cell of the keyboard until the game is over
+                    while closed := bot.closed_cells(player):
+                        await post(callback_update(next(update_ids), player, closed[0]))
+        finally:
+            await runner.cleanup()
+            await handlers.close_context()
+            await (await bot.get_session()).close()
+    methods = collections.Counter(method for method, _ in bot.requests)
+    print(f"Webhook self-test: responses {dict(statuses)}, Bot API requests {dict(methods)}")
+    return statuses[401] == 1 and set(statuses) == {200, 401} and methods["sendMessage"] == players \
+        and methods["editMessageText"] > 0
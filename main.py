@@ -1,20 +1,48 @@
 import argparse
 import asyncio
+import concurrent.futures
 import logging
 import os
 
 import aiogram
 from dotenv import load_dotenv
-from bot import handlers
-
-# Configure logging
-logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO,
-                    filename='logs.log')
+from bot import handlers, webhook, log_config, metrics, board_pool
 
 
 def arg_parse():
+    load_dotenv()
     parser = argparse.ArgumentParser()
-    parser.add_argument("--token", type=str, required=True)
+    parser.add_argument("--mode", choices=["polling", "webhook"], default=os.environ.get("BOT_MODE", "polling"))
+    parser.add_argument("--host", type=str, default=os.environ.get("WEBHOOK_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("WEBHOOK_PORT", 8080)))
+    parser.add_argument("--path", type=str, default=os.environ.get("WEBHOOK_PATH", "/webhook"))
+    parser.add_argument("--webhook-url", type=str, default=os.environ.get("WEBHOOK_URL"),
+                        help="public url telegram should deliver updates to, webhook is not registered if omitted")
+    parser.add_argument("--webhook-secret", type=str, default=os.environ.get("WEBHOOK_SECRET"),
+                        help="token telegram sends with every update, other requests are rejected; "
+                             "a random one is used with --webhook-url if it is not set")
+    parser.add_argument("--redis-url", type=str, default=os.environ.get("REDIS_URL"),
+                        help="keep state in redis, so several workers can serve the bot")
+    parser.add_argument("--metrics-host", type=str, default=os.environ.get("METRICS_HOST", "127.0.0.1"))
+    parser.add_argument("--metrics-port", type=int, default=int(os.environ.get("METRICS_PORT", 9090)),
+                        help="port of the /metrics endpoint, 0 disables it")
+    parser.add_argument("--games-memory-mb", type=float, default=float(os.environ.get("GAMES_MEMORY_MB", 64)),
+                        help="memory for running games, least recently played ones are moved to the storage")
+    parser.add_argument("--games-idle-ttl", type=float, default=float(os.environ.get("GAMES_IDLE_TTL", 900)),
+                        help="seconds after which an untouched game is moved to the storage")
+    parser.add_argument("--checkpoint-interval", type=float,
+                        default=float(os.environ.get("CHECKPOINT_INTERVAL", 5)),
+                        help="seconds between background writes of changed state to the sqlite files")
+    parser.add_argument("--checkpoint-dirty", type=int, default=int(os.environ.get("CHECKPOINT_DIRTY", 1000)),
+                        help="changed keys of a file which trigger a write before the interval ends")
+    parser.add_argument("--no-guess", action="store_true", default=os.environ.get("BOT_NO_GUESS", "") == "1",
+                        help="only boards which can be cleared without guessing")
+    parser.add_argument("--pool-size", type=int, default=int(os.environ.get("BOARD_POOL_SIZE", 20)),
+                        help="ready games kept for every difficulty, 0 generates every game on request")
+    parser.add_argument("--pool-processes", type=int, default=int(os.environ.get("BOARD_POOL_PROCESSES", 0)),
+                        help="processes generating boards for the pool, 0 uses a thread")
+    parser.add_argument("--self-test", action="store_true",
+                        help="post synthetic updates to a local webhook server and exit")
     return parser.parse_args()
 
 
@@ -23,20 +51,50 @@ def read_token():
     return os.environ['TOKEN']
 
 
+def setup_logging():
+    return log_config.setup_logging(
+        path=os.environ.get("LOG_FILE", "logs.log"),
+        level=logging.getLevelName(os.environ.get("LOG_LEVEL", "INFO")),
+        max_bytes=int(os.environ.get("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+        backup_count=int(os.environ.get("LOG_BACKUP_COUNT", 5)),
+        moves_sample_rate=float(os.environ.get("LOG_MOVES_SAMPLE_RATE", 0.1)),
+    )
+
+
 async def main():
+    args = arg_parse()
+    if args.self_test:
+        if not await webhook.self_test():
+            raise SystemExit(1)
+        return
     token = read_token()
     bot = aiogram.Bot(token=token)
+    metrics_server = None
     try:
         dp = aiogram.Dispatcher(bot)
-        handlers.load_context()
+        handlers.load_context(redis_url=args.redis_url, games_memory_budget=int(args.games_memory_mb * 1024 * 1024),
+                              games_idle_ttl=args.games_idle_ttl)
         handlers.setup_handlers(dp)
-        await dp.start_polling()
+        handlers.backend.start_checkpoints(args.checkpoint_interval, args.checkpoint_dirty)
+        executor = concurrent.futures.ProcessPoolExecutor(args.pool_processes) if args.pool_processes else None
+        handlers.start_board_pool(board_pool.BoardPool(args.pool_size, no_guess=args.no_guess, executor=executor))
+        if args.metrics_port:
+            metrics_server = await metrics.start_server(args.metrics_host, args.metrics_port)
+        if args.mode == "webhook":
+            await webhook.run_webhook(dp, args.host, args.port, args.path, args.webhook_url, args.webhook_secret)
+        else:
+            await dp.start_polling()
     finally:
-        handlers.close_context()
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+        await handlers.close_context()
         await (await bot.get_session()).close()
 
 if __name__ == '__main__':
+    log_listener = setup_logging()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         pass
+    finally:
+        log_listener.stop()
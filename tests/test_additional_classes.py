@@ -0,0 +1,58 @@
+import asyncio
+import random
+
+import pytest
+
+from bot import additional_classes
+
+
+@pytest.mark.parametrize('max_score', [5, 5000])
+def test_leaderboard_matches_sorting(max_score: int):
+    scores = {user_id: random.randrange(0, max_score) for user_id in range(200)}
+    leaderboard = additional_classes.Leaderboard(dict(scores))
+    for _ in range(300):
+        user_id, score = random.randrange(0, 250), random.randrange(0, max_score * 2)
+        scores[user_id] = score
+        leaderboard.update(user_id, score)
+
+    assert leaderboard.scores == scores
+    expected_top = sorted(scores.values(), reverse=True)[:10]
+    assert [scores[user_id] for user_id in leaderboard.top(10)] == expected_top
+    for user_id, score in scores.items():
+        assert leaderboard.rank(user_id) == sum(1 for s in scores.values() if s > score) + 1
+
+
+def test_keyed_lock_serializes_per_key():
+    lock = additional_classes.KeyedLock()
+    order = []
+
+    async def task(key: int, name: str):
+        async with lock(key):
+            order.append(f"{name} start")
+            await asyncio.sleep(0.01)
+            order.append(f"{name} end")
+
+    async def run():
+        await asyncio.gather(task(1, "a"), task(1, "b"), task(2, "c"))
+
+    asyncio.run(run())
+    assert order.index("a end") < order.index("b start")
+    assert order.index("c start") < order.index("a end")
+    assert lock.stats == {"acquired": 3, "contended": 1, "max_depth": 2}
+    assert lock.waiting == 0 and not lock._locks
+
+
+def test_storage_keeps_old_file_when_dump_fails(tmp_path, monkeypatch):
+    path = str(tmp_path / "users.pickle")
+    with additional_classes.Storage(path) as data:
+        data[1] = "saved"
+
+    def broken_dump(obj, f):
+        f.write(b"partial")
+        raise OSError("disk full")
+
+    monkeypatch.setattr(additional_classes.dill, "dump", broken_dump)
+    with pytest.raises(OSError):
+        with additional_classes.Storage(path) as data:
+            data[2] = "lost"
+    assert additional_classes.Storage(path).load() == {1: "saved"}
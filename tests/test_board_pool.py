@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+
+from bot import board_pool
+
+
+def test_pool_is_refilled_in_background():
+    async def run():
+        pool = board_pool.BoardPool(size=2, modes=(0, 3))
+        assert (await pool.get(0)).config.mode == 0
+        assert pool.stats == {"miss": 1}
+        with pytest.raises(ValueError):
+            await pool.get(7)
+        assert pool.stats == {"miss": 1}
+        pool.start()
+        for _ in range(100):
+            if len(pool) == 4:
+                break
+            await asyncio.sleep(0.01)
+        assert len(pool) == 4
+        g = await pool.get(3)
+        assert g.config.mode == 3 and g.config.flood_fill
+        assert pool.stats == {"miss": 1, "hit": 1}
+        for _ in range(100):
+            if len(pool) == 4:
+                break
+            await asyncio.sleep(0.01)
+        assert len(pool) == 4
+        pool.close()
+
+    asyncio.run(run())
+
+
+def test_no_guess_miss_is_generated_in_executor():
+    async def run():
+        pool = board_pool.BoardPool(size=0, no_guess=True)
+        g = await pool.get(3)
+        assert g.config.mode == 3 and g.config.no_guess
+        assert pool.stats == {"miss": 1}
+
+    asyncio.run(run())
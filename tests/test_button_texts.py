@@ -4,7 +4,8 @@ import bot.button_texts as but_texts
 
 
 @pytest.mark.parametrize('method',
-                         ['main_menu', 'play', 'profile', 'language', 'statistics', 'game_history', 'leaderboard'])
+                         ['main_menu', 'play', 'profile', 'language', 'statistics', 'game_history', 'game_replay',
+                          'leaderboard'])
 @pytest.mark.parametrize('lang', ['ru', 'en'])
 def test_game_creation(lang: str, method: str):
     user_mock = MagicMock()
@@ -0,0 +1,21 @@
+import pytest
+
+from bot import callback_codec, handlers
+
+
+@pytest.mark.parametrize('cell', [(1, 0, 0), (2 ** 32 - 1, 10, 7), (123456, 255, 255)])
+def test_cell_round_trip(cell):
+    data = callback_codec.encode_cell(*cell)
+    assert len(data) <= 12
+    assert callback_codec.decode_cell(handlers.ParsedCallback.parse(data).args) == cell
+
+
+def test_legacy_cell():
+    assert callback_codec.decode_cell(("3", "5")) == (callback_codec.LEGACY_GAME_ID, 3, 5)
+
+
+@pytest.mark.parametrize('args', [(), ("",), ("2AAAAAAAA",), ("1AAAA",), ("1AAA!AAAA",), ("1ЖЖЖЖЖЖЖЖ",),
+                                  ("a", "b"), ("1", "2", "3")])
+def test_malformed_cell(args):
+    with pytest.raises(ValueError):
+        callback_codec.decode_cell(args)
@@ -0,0 +1,82 @@
+import asyncio
+import sys
+from unittest.mock import AsyncMock, MagicMock
+
+import aiogram.types.inline_keyboard
+
+from bot import handlers, storage, keyboard_generator, messages, button_texts, callback_codec
+from bot.game import saper_game
+
+
+def _markup(text: str):
+    return aiogram.types.inline_keyboard.InlineKeyboardMarkup().add(
+        aiogram.types.inline_keyboard.InlineKeyboardButton(text=text, callback_data="main_menu"))
+
+
+def test_edit_message_sends_single_request_and_skips_unchanged():
+    message = MagicMock()
+    message.text = "Great! No bomb here!\nCurrent score: 1"
+    message.reply_markup = _markup("1️⃣")
+    message.edit_text = AsyncMock()
+    handlers.edit_stats.clear()
+
+    asyncio.run(handlers.edit_message(message, "Great! No bomb here!\nCurrent score: 1\n", _markup("1️⃣")))
+    message.edit_text.assert_not_called()
+
+    asyncio.run(handlers.edit_message(message, "Great! No bomb here!\nCurrent score: 1", _markup("2️⃣")))
+    message.edit_text.assert_awaited_once()
+    assert handlers.edit_stats == {"skipped": 1, "sent": 1, "saved": 3}
+
+    # a changed text is enough, keyboards are not serialized
+    message.reply_markup, markup = MagicMock(), MagicMock()
+    asyncio.run(handlers.edit_message(message, "Great! No bomb here!\nCurrent score: 2", markup))
+    message.reply_markup.to_python.assert_not_called()
+    markup.to_python.assert_not_called()
+    assert message.edit_text.await_count == 2
+
+
+def test_callback_router_dispatches_by_exact_prefix():
+    router = handlers.CallbackRouter()
+    main_menu, main = AsyncMock(), AsyncMock()
+    router.register("main_menu", main_menu)
+    router.register("main", main)
+    for data in ("main_menu", "main.play", "unknown.1"):
+        asyncio.run(router(MagicMock(data=data)))
+    main_menu.assert_awaited_once()
+    assert main_menu.await_args.args[1] == handlers.ParsedCallback("main_menu")
+    main.assert_awaited_once()
+    assert main.await_args.args[1] == handlers.ParsedCallback("main", ("play",))
+
+
+def test_play_stores_game_measured_with_its_keyboard(tmp_path, monkeypatch):
+    games = storage.SqliteStorage(str(tmp_path / "games.sqlite3"), "games", memory_budget=10 ** 9,
+                                  sizeof=keyboard_generator.game_memory_size)
+    monkeypatch.setattr(handlers, "user_to_game", games)
+    handler = handlers.PlayHandler()
+    handler.reply_messages, handler.keyboard_buttons = messages.MESSAGES["en"], button_texts.TEXTS["en"]
+    message = MagicMock(spec=aiogram.types.Message)
+    message.from_user.id = 1
+    message.answer = AsyncMock()
+
+    asyncio.run(handler.handle(message))
+    g = games[1]
+    assert games._sizes[1] == keyboard_generator.game_memory_size(g) > sys.getsizeof(g)
+    games.close()
+
+
+def test_tap_on_opened_cell_only_answers_the_query(monkeypatch):
+    g = saper_game.create_game(0, seed=1)
+    games = storage.MemoryStorage({1: g})
+    games.store = AsyncMock()
+    monkeypatch.setattr(handlers, "user_to_game", games)
+    handler = handlers.GameCallBackHandler()
+    handler.reply_messages, handler.keyboard_buttons = messages.MESSAGES["en"], button_texts.TEXTS["en"]
+    handler.args = (callback_codec.encode_cell(g.game_id, *divmod(g.start, g.config.cols)).split(".")[1],)
+    query = MagicMock()
+    query.from_user.id = 1
+    query.answer, query.message.edit_text = AsyncMock(), AsyncMock()
+
+    asyncio.run(handler.handle(query))
+    query.answer.assert_awaited_once_with("This cell was already opened")
+    query.message.edit_text.assert_not_called()
+    games.store.assert_not_awaited()
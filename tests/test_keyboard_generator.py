@@ -0,0 +1,21 @@
+import itertools
+
+import pytest
+
+from bot import keyboard_generator, button_texts
+from bot.game import saper_game
+
+
+@pytest.mark.parametrize('mode', [0, 3])
+def test_patched_game_keyboard_matches_game(mode: int):
+    g = saper_game.create_game(mode)
+    render = keyboard_generator.RenderInlineGameKeyboard()
+    texts = button_texts.TEXTS["en"]
+    keyboard = render(texts, g)
+    for x, y in itertools.product(range(g.config.rows), range(g.config.cols)):
+        event = g.reveal_coordinate(x, y)
+        assert render(texts, g, event) is keyboard
+        assert [[button.text for button in row] for row in keyboard.inline_keyboard] == \
+               [[keyboard_generator.grid_to_emoji[cell] for cell in row] for row in g.public_grid]
+        if event.game_over:
+            break
@@ -0,0 +1,11 @@
+import asyncio
+
+from benchmarks import load_test
+
+
+def test_load_harness_plays_full_games():
+    report = asyncio.run(load_test.run_load(users=5, games=2, concurrency=5))
+    assert report.games == 10
+    # every game is started with /play and takes at least one tap
+    assert report.updates >= 20
+    assert 0 < report.p50_ms <= report.p99_ms <= report.max_ms
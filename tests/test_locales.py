@@ -0,0 +1,34 @@
+import typing
+
+import pytest
+
+from bot import locales, keyboard_generator, button_texts
+
+
+def _shape(value: typing.Any):
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return len(value)
+    return type(value)
+
+
+@pytest.mark.parametrize('code', list(locales.catalogs()))
+def test_catalog_has_every_text(code: str):
+    catalogs = locales.catalogs()
+    assert _shape(catalogs[code]) == _shape(catalogs[locales.DEFAULT_LANGUAGE])
+
+
+def test_new_catalog_needs_no_changes_of_the_others(monkeypatch):
+    catalogs = dict(locales.catalogs(), fr=dict(locales.catalogs()["en"], language_name="Français"))
+    monkeypatch.setattr(locales, "catalogs", lambda: catalogs)
+    texts = button_texts.CatalogKeyboardButtonsTexts(catalogs["ru"]["buttons"])
+    assert texts.language() == ["English", "Русский", "Français"]
+
+
+@pytest.mark.parametrize('render', [keyboard_generator.RenderInitialMenu, keyboard_generator.RenderPlayMenu,
+                                    keyboard_generator.RenderLanguageMenu])
+def test_static_keyboards_are_built_once_per_language(render: typing.Type[keyboard_generator.RenderBaseKeyboard]):
+    en, ru = button_texts.TEXTS["en"], button_texts.TEXTS["ru"]
+    assert render()(en) is render()(en)
+    assert render()(en) is not render()(ru)
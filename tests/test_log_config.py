@@ -0,0 +1,36 @@
+import json
+import logging
+
+from bot import log_config
+
+
+def test_logs_are_written_as_json_lines_and_moves_are_sampled(tmp_path):
+    root_handlers = logging.getLogger().handlers
+    listener = log_config.setup_logging(str(tmp_path / "logs.log"), moves_sample_rate=0)
+    try:
+        logging.info("player: %s; game: %r", 1, "score: 0")
+        logging.getLogger(log_config.MOVES_LOGGER).info("player: %s", 1)
+    finally:
+        listener.stop()
+        logging.getLogger().handlers = root_handlers
+        logging.getLogger(log_config.MOVES_LOGGER).filters.clear()
+    lines = [json.loads(line) for line in (tmp_path / "logs.log").read_text().splitlines()]
+    assert [line["message"] for line in lines] == ["player: 1; game: 'score: 0'"]
+    assert lines[0]["level"] == "INFO"
+
+
+def test_exception_traceback_is_written_to_its_own_field(tmp_path):
+    root_handlers = logging.getLogger().handlers
+    listener = log_config.setup_logging(str(tmp_path / "logs.log"))
+    try:
+        try:
+            raise ValueError("bad move")
+        except ValueError:
+            logging.exception("player: %s", 1)
+    finally:
+        listener.stop()
+        logging.getLogger().handlers = root_handlers
+        logging.getLogger(log_config.MOVES_LOGGER).filters.clear()
+    line, = [json.loads(line) for line in (tmp_path / "logs.log").read_text().splitlines()]
+    assert line["message"] == "player: 1"
+    assert line["exception"].startswith("Traceback") and "ValueError: bad move" in line["exception"]
@@ -0,0 +1,35 @@
+import asyncio
+
+from bot import metrics
+
+
+def test_metrics_are_rendered_in_prometheus_format():
+    histogram = metrics.Histogram("test_latency_seconds", "Latency", ["handler"], buckets=(0.1, 1))
+    histogram.observe(0.05, handler="Play")
+    histogram.observe(0.5, handler="Play")
+    counter = metrics.Counter("test_errors_total", "Errors", ["handler"])
+    counter.inc(handler='Game"Handler')
+    metrics.Gauge("test_games", "Games", function=lambda: 3)
+    try:
+        text = metrics.render()
+    finally:
+        del metrics.REGISTRY[-3:]
+    assert '# TYPE test_latency_seconds histogram' in text
+    assert 'test_latency_seconds_bucket{handler="Play",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{handler="Play",le="+Inf"} 2' in text
+    assert 'test_latency_seconds_count{handler="Play"} 2' in text
+    assert 'test_errors_total{handler="Game\\"Handler"} 1.0' in text
+    assert 'test_games 3.0' in text
+
+
+def test_coroutine_gauges_are_awaited_before_scrape():
+    async def games() -> int:
+        return 4
+
+    metrics.Gauge("test_async_games", "Games", function=games)
+    try:
+        asyncio.run(metrics.collect())
+        text = metrics.render()
+    finally:
+        del metrics.REGISTRY[-1:]
+    assert 'test_async_games 4.0' in text
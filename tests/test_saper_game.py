@@ -17,3 +17,117 @@ def test_game_creation(mode: typing.Tuple[int, typing.List[int]]):
     assert len(g.grid[0]) == len(g.public_grid[0]) == e_c
     assert g.config.explosives_count == e_ex
     assert g.config.lives == e_lives
+
+
+@pytest.mark.parametrize('mode', [0, 1, 2, 3])
+def test_game_record_matches_public_grid(mode: int):
+    g = saper_game.create_game(mode)
+    for x in range(g.config.rows):
+        if g.reveal_coordinate(x, x % g.config.cols).game_over:
+            break
+    record = saper_game.GameRecord.from_game(g)
+    assert record.mode == mode
+    assert record.score == g.score
+    for row in range(g.config.rows):
+        assert [record.cell(row, col) for col in range(g.config.cols)] == g.public_grid[row]
+
+
+@pytest.mark.parametrize('size', [(1, 1, 0), (3, 7, 10), (100, 100, 3000)])
+def test_grid_counts_neighbouring_mines(size: typing.Tuple[int, int, int]):
+    rows, cols, explosives_count = size
+    explosives = saper_game.Game.generate_random_explosives(rows, cols, explosives_count)
+    mines = sum(1 << (x * cols + y) for x, y in explosives)
+    cells = saper_game.Game.generate_grid(rows, cols, mines)
+    mine_set = set(explosives)
+    for x in range(rows):
+        for y in range(cols):
+            expected = saper_game.MINE if (x, y) in mine_set else sum(
+                (nx, ny) in mine_set for nx in range(x - 1, x + 2) for ny in range(y - 1, y + 2))
+            assert cells[x * cols + y] == expected
+
+
+def test_flood_fill_opens_zero_region():
+    g = saper_game.Game(rows=30, cols=30, explosives_count=3, lives=1, flood_fill=True)
+    zero = next(i for i, value in enumerate(g.cells) if value == 0 and not g.opened[i])
+    opened_before, score_before = g.cells_opened, g.score
+    event = g.reveal_coordinate(*divmod(zero, 30))
+    assert event.status_code in (1, 2)
+    assert len(event.opened_coordinates) == len(set(event.opened_coordinates)) > 1
+    assert g.cells_opened == opened_before + len(event.opened_coordinates)
+    assert g.score == score_before + sum(g.cells[x * 30 + y] + 1 for x, y in event.opened_coordinates)
+    for x, y in event.opened_coordinates:
+        assert g.cells[x * 30 + y] != saper_game.MINE
+        if g.cells[x * 30 + y] == 0:
+            # every neighbour of an opened zero is opened as well
+            assert all(g.opened[nx * 30 + ny] for nx in range(max(x - 1, 0), min(x + 2, 30))
+                       for ny in range(max(y - 1, 0), min(y + 2, 30)))
+
+
+@pytest.mark.parametrize('size', [(8, 8, 0), (8, 8, 64), (100, 100, 9999)])
+def test_random_explosives_are_distinct(size: typing.Tuple[int, int, int]):
+    rows, cols, explosives = size
+    coordinates = saper_game.Game.generate_random_explosives(rows, cols, explosives)
+    assert len(set(coordinates)) == explosives
+    assert all(0 <= x < rows and 0 <= y < cols for x, y in coordinates)
+    with pytest.raises(ValueError):
+        saper_game.Game.generate_random_explosives(rows, cols, rows * cols + 1)
+
+
+def test_same_seed_same_game():
+    g1, g2 = saper_game.create_game(3, seed=42), saper_game.create_game(3, seed=42)
+    assert g1.seed == 42
+    assert g1.cells == g2.cells and g1.opened == g2.opened
+    assert saper_game.create_game(3).seed != saper_game.create_game(3).seed
+
+
+@pytest.mark.parametrize('mode', [0, 1, 2, 3])
+def test_replay_rebuilds_every_move(mode: int):
+    g = saper_game.create_game(mode)
+    states = [(bytes(g.opened), g.score)]
+    for idx in range(g.config.rows * g.config.cols):
+        event = g.reveal_coordinate(*divmod(idx, g.config.cols))
+        if event.status_code != 3:
+            states.append((bytes(g.opened), g.score))
+        if event.game_over:
+            break
+    record = saper_game.GameRecord.from_game(g)
+    assert record.move_count == len(states) - 1
+    assert len(record.moves) == record.move_count
+    for step, state in enumerate(states):
+        replayed = record.replay(step)
+        assert (bytes(replayed.opened), replayed.score) == state
+    assert saper_game.GameRecord.from_game(record.replay()).opened == record.opened
+    with pytest.raises(ValueError):
+        saper_game.GameRecord(rows=1, cols=1, mines=b"\0", opened=b"\0", score=0, won=False).replay()
+
+
+def test_replay_uses_stored_board(monkeypatch):
+    g = saper_game.create_game(3, no_guess=True)
+    g.reveal_coordinate(*divmod(g.opened.index(0), g.config.cols))
+    record = saper_game.GameRecord.from_game(g)
+
+    def generate_board(*args, **kwargs):
+        raise AssertionError("replay must not generate the board")
+
+    monkeypatch.setattr(saper_game.Game, "generate_board", generate_board)
+    replayed = record.replay()
+    assert (replayed.cells, replayed.opened, replayed.start) == (g.cells, g.opened, g.start)
+
+
+@pytest.mark.parametrize('size', [(1, 1), (1, 5), (3, 7), (8, 8)])
+def test_neighbours_table(size: typing.Tuple[int, int]):
+    rows, cols = size
+    table = saper_game.neighbours(rows, cols)
+    assert table is saper_game.neighbours(rows, cols)
+    for x in range(rows):
+        for y in range(cols):
+            expected = {nx * cols + ny for nx in range(rows) for ny in range(cols)
+                        if max(abs(nx - x), abs(ny - y)) == 1}
+            assert sorted(table[x * cols + y]) == sorted(expected)
+
+
+@pytest.mark.parametrize('cell', [(-1, 0), (0, -1), (10, 0), (0, 8)])
+def test_reveal_outside_of_grid(cell: typing.Tuple[int, int]):
+    g = saper_game.create_game(1)
+    with pytest.raises(ValueError):
+        g.reveal_coordinate(*cell)
@@ -0,0 +1,44 @@
+import pytest
+
+from bot.game import saper_game, solver
+
+
+def _bitset(cells) -> int:
+    return sum(1 << i for i in cells)
+
+
+@pytest.mark.parametrize('mode', [0, 1, 2, 3])
+def test_no_guess_boards_are_solvable(mode: int):
+    for seed in range(20):
+        g = saper_game.create_game(mode, seed=seed, no_guess=True)
+        rows, cols = g.config.rows, g.config.cols
+        opened = _bitset(i for i, value in enumerate(g.opened) if value)
+        assert g.config.no_guess
+        assert opened & g.mines == 0 and g.mines.bit_count() == g.config.explosives_count
+        assert solver.is_solvable(rows, cols, g.mines, opened)
+
+
+def test_no_guess_falls_back_to_a_guess_board(monkeypatch):
+    monkeypatch.setattr(solver, "make_solvable", lambda *args: None)
+    g = saper_game.create_game(3, seed=1, no_guess=True)
+    assert not g.config.no_guess
+    assert g.mines.bit_count() == g.config.explosives_count
+
+
+@pytest.mark.parametrize('mode', [0, 1, 2, 3])
+def test_solver_opens_only_safe_cells(mode: int):
+    for seed in range(50):
+        g = saper_game.create_game(mode, seed=seed)
+        opened = _bitset(i for i, value in enumerate(g.opened) if value)
+        solved = solver.solve(g.config.rows, g.config.cols, g.mines, opened)
+        assert solved & g.mines == 0
+        assert solved & opened == opened
+
+
+def test_solver_needs_pairs_of_constraints():
+    # 1 2 1 pattern over a closed row: the opened row alone tells where both mines are
+    # row 0: * * *   mines at (0, 0) and (0, 2)
+    # row 1: 1 2 1
+    assert solver.solve(2, 3, _bitset([0, 2]), _bitset([3, 4, 5])) == _bitset([1, 3, 4, 5])
+    # a single 1 next to three closed cells is a guess
+    assert not solver.is_solvable(2, 2, _bitset([0]), _bitset([3]))
@@ -0,0 +1,173 @@
+import asyncio
+import contextlib
+import sqlite3
+
+import pytest
+
+from bot import storage
+
+
+@pytest.mark.parametrize('flush_interval', [0, 3600])
+def test_storage_round_trip(tmp_path, flush_interval: float):
+    s = storage.SqliteStorage(str(tmp_path / "t.sqlite3"), "t", flush_interval=flush_interval)
+    s[1] = {"score": 10}
+    s[2] = None
+    s[3] = "removed"
+    del s[3]
+    s.close()
+
+    s = storage.SqliteStorage(str(tmp_path / "t.sqlite3"), "t")
+    assert len(s) == 2 and 3 not in s
+    assert not s._cache
+    assert s[1] == {"score": 10}
+    assert s[2] is None
+    with pytest.raises(KeyError):
+        _ = s[3]
+    s.close()
+
+
+def test_storage_keeps_bounded_cache(tmp_path):
+    s = storage.SqliteStorage(str(tmp_path / "t.sqlite3"), "t", flush_interval=3600, cache_size=2)
+    for key in range(5):
+        s[key] = key * 10
+    assert list(s._cache) == [3, 4]
+    assert s[0] == 0
+    assert list(s._cache) == [4, 0]
+    assert 1 in s and 5 not in s
+    assert len(s) == 5
+    s.close()
+
+
+def test_storage_evicts_over_memory_budget_and_idle_values(tmp_path, monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(storage.time, "monotonic", lambda: now[0])
+    s = storage.SqliteStorage(str(tmp_path / "t.sqlite3"), "t", flush_interval=3600, memory_budget=250,
+                              idle_ttl=60, sizeof=len)
+    for key in range(3):
+        s[key] = "x" * 100
+    assert list(s._cache) == [1, 2]
+    assert s.stats == {"evictions": 1}
+    assert s[0] == "x" * 100
+    assert list(s._cache) == [2, 0]
+    assert s.stats == {"evictions": 2, "loads": 1}
+    now[0] = 30
+    s[3] = "y"
+    now[0] = 61
+    assert s[3] == "y"
+    assert list(s._cache) == [3]
+    assert s.stats == {"evictions": 4, "loads": 1}
+    assert s._cache_bytes == 1
+    assert len(s) == 4
+    s.close()
+
+
+def test_compact_releases_free_pages_without_vacuum(tmp_path):
+    s = storage.SqliteStorage(str(tmp_path / "t.sqlite3"), "t", flush_interval=3600)
+    for key in range(200):
+        s[key] = "x" * 1000
+    s.flush()
+    for key in range(200):
+        del s[key]
+    s.flush()
+    assert s._writer.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    s.compact()
+    assert s._writer.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    s.close()
+
+
+def test_leaderboard_scores_are_integer_rows(tmp_path):
+    legacy = storage.SqliteStorage(str(tmp_path / "scores.sqlite3"), "scores")
+    legacy[1] = 5
+    legacy.close()
+    backend = storage.SqliteBackend(str(tmp_path))
+    leaderboard = backend.leaderboard()
+    leaderboard.update(2, 7)
+    assert leaderboard.top() == [2, 1]
+    asyncio.run(backend.close())
+    with contextlib.closing(sqlite3.connect(tmp_path / "scores.sqlite3")) as connection:
+        assert connection.execute("SELECT key, typeof(value) FROM scores ORDER BY key").fetchall() == \
+               [(1, "integer"), (2, "integer")]
+    backend = storage.SqliteBackend(str(tmp_path))
+    assert backend.leaderboard().rank(1) == 2
+    asyncio.run(backend.close())
+
+
+def test_checkpoints_write_in_background(tmp_path):
+    path = str(tmp_path / "t.sqlite3")
+
+    async def run():
+        backend = storage.SqliteBackend(str(tmp_path))
+        s = backend.mapping("t")
+        backend.start_checkpoints(interval=3600, dirty_threshold=3)
+        s[1] = [1]
+        s[2] = "removed"
+        del s[2]
+        # below the threshold nothing is written
+        await asyncio.sleep(0.05)
+        with contextlib.closing(sqlite3.connect(path)) as connection:
+            assert connection.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+        # len and iteration do not force a write
+        assert len(s) == 1 and list(s) == [1] and dict(s.items()) == {1: [1]}
+        assert s.dirty == 1
+        s[3] = "x"
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if not s._pending and not s._dirty:
+                break
+        # a value changed after the snapshot is written by the next checkpoint
+        s[1].append(2)
+        s[1] = s[1]
+        s[4] = "y"
+        await s.checkpoint(max_dumps=1)
+        assert s.dirty == 1
+        del s[4]
+        await s.checkpoint()
+        assert len(s) == 2
+        reader = storage.SqliteStorage(path, "t")
+        assert dict(reader.items()) == {1: [1, 2], 3: "x"}
+        reader.close()
+        await backend.close()
+
+    asyncio.run(run())
+
+
+def test_redis_backend_shares_state_between_workers():
+    fakeredis = pytest.importorskip("fakeredis")
+
+    server = fakeredis.FakeServer()
+
+    def backend() -> storage.RedisBackend:
+        return storage.RedisBackend(client=fakeredis.FakeRedis(server=server),
+                                    async_client=fakeredis.FakeAsyncRedis(server=server))
+
+    first, second = backend(), backend()
+    order = []
+
+    async def worker(backend: storage.RedisBackend, name: str):
+        async with backend.locks(1):
+            order.append(f"{name} start")
+            await asyncio.sleep(0.02)
+            order.append(f"{name} end")
+
+    async def run():
+        await first.mapping("users").store(1, {"score": 10})
+        assert second.mapping("users")[1] == {"score": 10}
+        assert await second.mapping("users").load_many([1, 2]) == [{"score": 10}, None]
+        assert dict(second.mapping("users").items()) == {1: {"score": 10}}
+        assert await second.mapping("users").size() == 1
+        await second.mapping("users").remove(1)
+        assert await first.mapping("users").load(1) is None
+        assert 1 not in first.mapping("users") and len(first.mapping("users")) == 0
+
+        await first.leaderboard().record(1, 5)
+        await second.leaderboard().record(2, 7)
+        second.leaderboard().update(3, 5)
+        top, rank = await first.leaderboard().standings(1, 2)
+        assert top in ([2, 3], [2, 1]) and rank == first.leaderboard().rank(3) == 2
+
+        await asyncio.gather(worker(first, "a"), worker(second, "b"))
+        await first.close()
+        await second.close()
+
+    asyncio.run(run())
+    assert order in (["a start", "a end", "b start", "b end"], ["b start", "b end", "a start", "a end"])
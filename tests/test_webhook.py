@@ -0,0 +1,7 @@
+import asyncio
+
+from bot import webhook
+
+
+def test_webhook_self_test():
+    assert asyncio.run(webhook.self_test(players=2))